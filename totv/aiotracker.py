@@ -0,0 +1,611 @@
+# coding=utf-8
+"""
+asyncio flavour of the tracker API client. Mirrors the interface of :class:`totv.tracker.Client`
+with every method being a coroutine, so many tracker calls can be in flight on a single
+event loop.
+
+>>> async with AsyncClient("https://tracker:34001/api") as client:
+>>>     found, not_found = await client.torrent_get_all(info_hashes, concurrency=50)
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+import asyncio
+import time
+from base64 import b64encode
+from collections import deque
+import aiohttp
+from redis import asyncio as aioredis
+from redis.exceptions import ResponseError
+from http import client as httplib
+from operator import attrgetter, itemgetter
+from totv import exc, jsonutil
+from totv.cache import LRUCache, MISSING
+from totv.metrics import Metrics, endpoint_name
+from totv.records import Peer, Torrent, TorrentCounts, User
+from totv.tracker import BulkResult, InfoHash, bot_api_headers, call_item, check_status, chunks, make_redis_pool, \
+    unquote_peers, user_from_redis, validate_info_hash, validate_torrent_id
+
+
+class AsyncClient(object):
+    """ A non-blocking API client used to communicate with the tracker
+
+    The HTTP session is created lazily on first use so the client can be built outside of a
+    running event loop. Pooled HTTP and redis connections belong to the loop they were
+    opened on, so a client is bound to the first loop it is used from until it is closed
+    and cannot be shared between asyncio.run calls without closing it in between. Call :meth:`close` (or use the client as an async
+    context manager) to release the pooled connections.
+
+    :param api_uri:
+    :type api_uri:
+    :param redis_host: redis host
+    :type redis_host: unicode
+    :param redis_port: Redis port
+    :type redis_port: int
+    :param redis_db: redis database to use
+    :type redis_db: int
+    :param verify: Verify tracker SSL cert
+    :type verify: bool
+    :param pool_maxsize: Maximum number of simultaneous HTTP connections
+    :type pool_maxsize: int
+    :param pool_maxsize_per_host: Maximum number of simultaneous HTTP connections per host, 0 for no limit
+    :type pool_maxsize_per_host: int
+    :param redis_max_connections: Maximum number of connections in the redis pool
+    :type redis_max_connections: int
+    :param redis_pool: Existing redis.asyncio connection pool to use, the other redis
+        options are ignored when set and the pool is left open by :meth:`close`
+    :type redis_pool: redis.asyncio.ConnectionPool
+    :param redis_url: Redis url, overrides redis_host and redis_port
+    :type redis_url: str
+    :param redis_unix_socket: Connect to redis over a unix socket
+    :type redis_unix_socket: str
+    :param redis_socket_keepalive: Enable TCP keepalive on the redis connections
+    :type redis_socket_keepalive: bool
+    :param redis_health_check_interval: Seconds an idle redis connection is trusted before
+        being checked with a PING, 0 to disable
+    :type redis_health_check_interval: int
+    :param scan_count: COUNT hint passed to redis SCAN when walking the keyspace
+    :type scan_count: int
+    :param batch_size: Number of redis reads sent in each pipeline by the bulk readers
+    :type batch_size: int
+    :param user_cache_size: Number of users kept in the write-through user cache, 0 to disable
+    :type user_cache_size: int
+    :param user_cache_ttl: Seconds a cached user stays valid
+    :type user_cache_ttl: float
+    :param coalesce: Share a single request and decoded result between identical concurrent
+        GET requests. Off by default since the results are then shared between tasks and
+        must not be mutated.
+    :type coalesce: bool
+    :param metrics: Metrics recorder shared with other clients, a new one is used by default
+    :type metrics: totv.metrics.Metrics
+    """
+
+    def __init__(self, api_uri, username="dev", password="dev", redis_host="localhost",
+                 redis_port=6379, redis_db=0, verify=False, timeout=3, pool_maxsize=100,
+                 pool_maxsize_per_host=0, redis_max_connections=50, scan_count=1000,
+                 batch_size=1000, user_cache_size=0, user_cache_ttl=30,
+                 coalesce=False, redis_pool=None, redis_url=None, redis_unix_socket=None,
+                 redis_socket_keepalive=False, redis_health_check_interval=0, metrics=None):
+        self._api_uri = api_uri
+        self._headers = {}
+        if username and password:
+            credentials = "{}:{}".format(username, password).encode()
+            self._headers['Authorization'] = "Basic " + b64encode(credentials).decode()
+        self._redis_host = redis_host
+        self._redis_port = redis_port
+        self._redis_db = redis_db
+        self._owns_redis_pool = redis_pool is None
+        if redis_pool is None:
+            redis_pool = make_redis_pool(
+                redis_host, redis_port, redis_db, url=redis_url,
+                unix_socket_path=redis_unix_socket, max_connections=redis_max_connections,
+                socket_keepalive=redis_socket_keepalive,
+                health_check_interval=redis_health_check_interval,
+                pool_class=aioredis.ConnectionPool)
+        self._redis = aioredis.StrictRedis(connection_pool=redis_pool)
+        self._verify = verify
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._pool_maxsize = pool_maxsize
+        self._pool_maxsize_per_host = pool_maxsize_per_host
+        self._session = None
+        self._session_loop = None
+        self._scan_count = scan_count
+        self._batch_size = batch_size
+        self._user_cache = LRUCache(user_cache_size, user_cache_ttl) if user_cache_size else None
+        self._coalesce = coalesce
+        self._inflight = {}
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """ Close all pooled HTTP and redis connections held by the client """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._session_loop = None
+        if self._owns_redis_pool:
+            await self._redis.connection_pool.disconnect()
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session_loop is not None and self._session_loop is not loop:
+            raise RuntimeError("AsyncClient used from a different event loop, close it "
+                               "first or create a new client for every loop")
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_maxsize,
+                                             limit_per_host=self._pool_maxsize_per_host,
+                                             ssl=None if self._verify else False)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self._headers,
+                                                  timeout=self._timeout)
+            self._session_loop = loop
+        return self._session
+
+    async def _request(self, path, method='get', payload=None, valid_codes=None):
+        resp, _ = await self._send(path, method, payload, valid_codes)
+        return resp
+
+    async def _send(self, path, method='get', payload=None, valid_codes=None):
+        """ Make a request and return the response along with its body, the connection is
+        released before returning so the body can no longer be read from the response
+        """
+        if method not in ("get", "post", "delete"):
+            raise NotImplementedError("Unsupported HTTP method: {}".format(method))
+        session = self._get_session()
+        start = time.perf_counter()
+        try:
+            async with session.request(method, self._make_url(path), json=payload) as resp:
+                body = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            self.metrics.record(endpoint_name(method, path), time.perf_counter() - start,
+                                error=err.__class__.__name__)
+            raise
+        elapsed = time.perf_counter() - start
+        try:
+            check_status(resp.status, valid_codes)
+        except exc.TrackerError as err:
+            self.metrics.record(endpoint_name(method, path), elapsed, len(body),
+                                err.__class__.__name__)
+            raise
+        self.metrics.record(endpoint_name(method, path), elapsed, len(body))
+        return resp, body
+
+    async def _get_json(self, path, decode=None):
+        """ Make a GET request and return the decoded json body. With coalesce set,
+        identical requests made concurrently by other tasks share the same HTTP call and
+        decoded result.
+
+        :param path: API path to fetch
+        :type path: str
+        :param decode: Optional function applied once to the decoded body
+        :type decode: callable
+        """
+        if not self._coalesce:
+            return await self._fetch_json(path, decode)
+        task = self._inflight.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_json(path, decode))
+            self._inflight[path] = task
+            task.add_done_callback(lambda _: self._inflight.pop(path, None))
+        # Shield the shared request so one cancelled caller does not cancel it for everyone
+        return await asyncio.shield(task)
+
+    async def _fetch_json(self, path, decode=None):
+        _, body = await self._send(path)
+        body = jsonutil.loads(body)
+        return decode(body) if decode else body
+
+    def _make_url(self, path):
+        return "".join([self._api_uri, path])
+
+    async def version(self):
+        return await self._get_json("/version")
+
+    async def uptime(self):
+        return await self._get_json("/uptime")
+
+    async def torrent_get(self, info_hash):
+        return await self._get_json("/torrent/{}".format(validate_info_hash(info_hash)))
+
+    async def _torrent_get_or_none(self, info_hash):
+        try:
+            torrent = await self.torrent_get(info_hash)
+        except exc.NotFoundError:
+            return None
+        if type(info_hash) is InfoHash:
+            # Copy, the decoded response may be shared with other callers
+            torrent = dict(torrent, info_hash=info_hash)
+        return torrent
+
+    async def torrent_get_iter(self, torrent_ids, concurrency=10):
+        """ Lazily look up a sequence of torrents, yielding results in the same order
+        as the input as soon as they are available.
+
+        :param torrent_ids: Info hashes to look up
+        :type torrent_ids: iterable
+        :param concurrency: Maximum number of concurrent requests
+        :type concurrency: int
+        :return: Async generator of (info_hash, torrent) tuples, torrent is None when not found
+        :rtype: async generator
+        """
+        pending = deque()
+        try:
+            for info_hash in torrent_ids:
+                pending.append((info_hash, asyncio.ensure_future(self._torrent_get_or_none(info_hash))))
+                if len(pending) >= max(concurrency, 1):
+                    info_hash, task = pending.popleft()
+                    yield info_hash, await task
+            while pending:
+                info_hash, task = pending.popleft()
+                yield info_hash, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def torrent_get_all(self, torrent_ids, concurrency=10):
+        """ Look up a list of torrents, splitting them into found and not found results.
+        Both lists keep the order of the input.
+
+        :param torrent_ids: Info hashes to look up
+        :type torrent_ids: iterable
+        :param concurrency: Maximum number of concurrent requests
+        :type concurrency: int
+        :return: Found torrents, info hashes that were not found
+        :rtype: list, list
+        """
+        found, not_found = [], []
+        async for info_hash, torrent in self.torrent_get_iter(torrent_ids, concurrency=concurrency):
+            if torrent is None:
+                not_found.append(info_hash)
+            else:
+                found.append(torrent)
+        return found, not_found
+
+    async def torrent_add(self, info_hash, torrent_id, name):
+        pl = {
+            'info_hash': validate_info_hash(info_hash),
+            'torrent_id': validate_torrent_id(torrent_id),
+            'name': name
+        }
+        return await self._request("/torrent", method='post', payload=pl)
+
+    async def torrent_del(self, info_hash):
+        try:
+            await self._request("/torrent/{}".format(info_hash), method='delete')
+        except exc.NotFoundError:
+            raise exc.NotFoundError("Unknown info hash, cannot delete: {}".format(info_hash))
+        return True
+
+    async def get_torrent_peers(self, info_hash, records=False):
+        peers = await self._get_json("/torrent/{}/peers".format(validate_info_hash(info_hash)),
+                                     decode=unquote_peers)
+        if records:
+            return [Peer.from_json(peer) for peer in peers]
+        return peers
+
+    async def get_torrent_counts(self, records=False):
+        """ Fetch and return a list of dictionary objects containing the current
+        data related to seeder/leeder/snatch counts for all torrents currently
+        tracked in the tracker. See :meth:`totv.tracker.Client.get_torrent_counts`
+
+        :param records: Return :class:`totv.records.TorrentCounts` instead of dicts
+        :type records: bool
+        :return: List of dictionaries with torrent stats
+        :rtype: []dict
+        """
+        counts = await self._get_json("/counts")
+        if records:
+            return [TorrentCounts.from_json(c) for c in counts]
+        return counts
+
+    async def get_torrent_counts_snapshot(self):
+        """ Fetch the current torrent counts as a columnar, numpy backed snapshot
+
+        :return: Snapshot of the counts for all torrents
+        :rtype: totv.counts.CountsSnapshot
+        """
+        # numpy is only required when snapshots are used
+        from totv.counts import CountsSnapshot
+        return CountsSnapshot.from_counts(await self.get_torrent_counts())
+
+    async def user_update(self, user_id, uploaded=None, downloaded=None, passkey=None, can_leech=None,
+                          enabled=None, partial=False):
+        """ Update a users tracker attributes, see :meth:`totv.tracker.Client.user_update`
+
+        :param partial: Only send the fields that are being changed
+        :type partial: bool
+        :return: Update success
+        :rtype: bool
+        """
+        changes = {k: v for k, v in (('uploaded', uploaded), ('downloaded', downloaded),
+                                     ('passkey', passkey), ('can_leech', can_leech),
+                                     ('enabled', enabled)) if v is not None}
+        if partial:
+            updated_data = changes
+        else:
+            # Transfer stats change as the user announces, never fill them from the cache
+            fresh = uploaded is None or downloaded is None
+            user = await self.user_get(user_id, use_cache=not fresh)
+            updated_data = {
+                "name": user["username"],
+                'uploaded': uploaded if uploaded is not None else user['uploaded'],
+                'downloaded': downloaded if downloaded is not None else user['downloaded'],
+                'can_leech': can_leech if can_leech is not None else user['can_leech'],
+                'passkey': passkey if passkey is not None else user['passkey'],
+                "enabled": enabled if enabled is not None else user["enabled"]
+            }
+        resp = await self._request("/user/{}".format(user_id), 'post', payload=updated_data)
+        if resp.status == httplib.ACCEPTED:
+            self._user_cache_update(user_id, changes)
+            return True
+        else:
+            raise exc.BadResponse("Received bad response from server: {}".format(resp.status))
+
+    def _user_cache_update(self, user_id, changes):
+        if self._user_cache is None:
+            return
+        user = self._user_cache.get(user_id)
+        if user is not MISSING:
+            user = dict(user)
+            user.update(changes)
+            # Keep the original expiry, frequent updates must not keep a stale copy alive
+            self._user_cache.replace(user_id, user)
+
+    async def user_get(self, user_id, use_cache=True):
+        if self._user_cache is not None and use_cache:
+            user = self._user_cache.get(user_id)
+            if user is not MISSING:
+                return dict(user)
+        try:
+            user = await self._get_json("/user/{}".format(user_id))
+        except exc.NotFoundError:
+            raise exc.NotFoundError("Unknown user id: {}".format(user_id))
+        if self._user_cache is not None:
+            self._user_cache.set(user_id, dict(user))
+        return user
+
+    async def _user_add(self, name, user_id, passkey, can_leech=True):
+        return await self._request("/user", method='post', payload={
+            'user_id': user_id,
+            'passkey': passkey,
+            'can_leech': can_leech,
+            'name': name
+        })
+
+    async def user_add(self, name, user_id, passkey, can_leech=True):
+        await self._user_add(name, user_id, passkey, can_leech=can_leech)
+        return await self.user_get(user_id)
+
+    async def user_del(self, user_id):
+        if self._user_cache is not None:
+            self._user_cache.delete(user_id)
+        await self._request("/user/{}".format(user_id), method="delete")
+        return True
+
+    async def whitelist_del(self, prefix):
+        try:
+            await self._request("/whitelist/{}".format(prefix), method='delete')
+        except exc.NotFoundError:
+            raise exc.NotFoundError("Unknown client prefix supplied: {}".format(prefix))
+        return True
+
+    async def whitelist_add(self, prefix, client_name):
+        try:
+            await self._request("/whitelist", method='post', payload={
+                'prefix': prefix,
+                'client': client_name
+            })
+        except exc.DuplicateError:
+            raise exc.DuplicateError(
+                "Whitelist entry already exists: {}/{}".format(prefix, client_name))
+        return True
+
+    async def _bulk(self, func, items, chunk_size=100, concurrency=10):
+        """ Async version of :meth:`totv.tracker.Client._bulk` """
+        result = BulkResult()
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def run(item):
+            async with semaphore:
+                return await call_item(func, item)
+
+        for chunk in chunks(items, chunk_size):
+            outcomes = await asyncio.gather(*[run(item) for item in chunk], return_exceptions=True)
+            for item, outcome in zip(chunk, outcomes):
+                if isinstance(outcome, (exc.TOTVException, aiohttp.ClientError, asyncio.TimeoutError)):
+                    result.add(item, outcome)
+                elif isinstance(outcome, BaseException):
+                    raise outcome
+                else:
+                    result.add(item)
+        return result
+
+    async def torrent_add_many(self, torrents, chunk_size=100, concurrency=10):
+        """ Add many torrents to the tracker, see :meth:`totv.tracker.Client.torrent_add_many`
+
+        :rtype: BulkResult
+        """
+        return await self._bulk(self.torrent_add, torrents, chunk_size, concurrency)
+
+    async def user_add_many(self, users, chunk_size=100, concurrency=10):
+        """ Add many users to the tracker, see :meth:`totv.tracker.Client.user_add_many`
+
+        :rtype: BulkResult
+        """
+        return await self._bulk(self._user_add, users, chunk_size, concurrency)
+
+    async def whitelist_add_many(self, clients, chunk_size=100, concurrency=10):
+        """ Add many client prefixes to the whitelist, see
+        :meth:`totv.tracker.Client.whitelist_add_many`
+
+        :rtype: BulkResult
+        """
+        return await self._bulk(self.whitelist_add, clients, chunk_size, concurrency)
+
+    def _scan_keys(self, pattern, scan_count=None):
+        return self._redis.scan_iter(match=pattern, count=scan_count or self._scan_count)
+
+    async def _hgetall_batched(self, keys, batch_size=None):
+        """ Async version of :meth:`totv.tracker.Client._hgetall_batched` """
+        batch_size = batch_size or self._batch_size
+        batch = []
+        async for key in keys:
+            batch.append(key)
+            if len(batch) >= batch_size:
+                for item in await self._hgetall_batch(batch):
+                    yield item
+                batch = []
+        if batch:
+            for item in await self._hgetall_batch(batch):
+                yield item
+
+    async def _hgetall_batch(self, batch):
+        pipe = self._redis.pipeline(transaction=False)
+        for key in batch:
+            pipe.hgetall(key)
+        return list(zip(batch, await pipe.execute(raise_on_error=False)))
+
+    async def _torrent_keys(self, scan_count=None):
+        async for key in self._scan_keys("t:t:*", scan_count):
+            try:
+                key = key.decode()
+            except UnicodeDecodeError:
+                pass
+            if len(key) == 44:
+                yield key
+
+    async def iter_torrents_redis(self, scan_count=None, batch_size=None, records=False):
+        """ Lazily iterate over all torrent hashes stored in redis as the SCAN cursor advances.
+        Hashes are read in pipelined batches.
+
+        :param scan_count: COUNT hint for each SCAN call, defaults to the clients scan_count
+        :type scan_count: int
+        :param batch_size: Number of HGETALL calls per pipeline, defaults to the clients batch_size
+        :type batch_size: int
+        :param records: Yield :class:`totv.records.Torrent` instead of raw hashes
+        :type records: bool
+        :return: Async generator of raw torrent hashes
+        :rtype: async generator
+        """
+        async for key, tor in self._hgetall_batched(self._torrent_keys(scan_count), batch_size):
+            if isinstance(tor, ResponseError):
+                print(tor)
+                print(key)
+                break
+            yield Torrent.from_redis(tor, info_hash=key[4:]) if records else tor
+
+    async def torrent_get_all_redis(self, scan_count=None, batch_size=None, records=False):
+        return [tor async for tor in self.iter_torrents_redis(scan_count=scan_count,
+                                                             batch_size=batch_size,
+                                                             records=records)]
+
+    async def iter_users_redis(self, scan_count=None, batch_size=None, records=False):
+        """ Lazily iterate over all users stored in redis as the SCAN cursor advances. Users
+        are read in pipelined batches.
+
+        :param scan_count: COUNT hint for each SCAN call, defaults to the clients scan_count
+        :type scan_count: int
+        :param batch_size: Number of HGETALL calls per pipeline, defaults to the clients batch_size
+        :type batch_size: int
+        :param records: Yield :class:`totv.records.User` instead of dicts
+        :type records: bool
+        :return: Async generator of user dicts
+        :rtype: async generator
+        """
+        decode = User.from_redis if records else user_from_redis
+        async for k, data in self._hgetall_batched(self._scan_keys("t:u:*", scan_count), batch_size):
+            if isinstance(data, ResponseError):
+                continue
+            try:
+                user = decode(data)
+            except Exception as err:
+                print(err)
+                print(data)
+                print(k)
+                break
+            else:
+                yield user
+
+    async def users_get_all_redis(self, sort="user_id", scan_count=None, batch_size=None,
+                                  records=False):
+        users = [user async for user in self.iter_users_redis(scan_count=scan_count,
+                                                              batch_size=batch_size,
+                                                              records=records)]
+        users.sort(key=attrgetter(sort) if records else itemgetter(sort))
+        return users
+
+
+class AsyncBotAPIClient(object):
+    """ Async version of :class:`totv.tracker.BotAPIClient`
+
+    >>> async with AsyncBotAPIClient("https://example.com/api/bot", key) as bot_api:
+    >>>     await bot_api.batch([("/announce", "POST", msg) for msg in messages])
+
+    :param base_url: Base url used for requests
+    :type base_url: str
+    :param api_key: Bots API Key
+    :type api_key: str
+    :param timeout: Seconds to wait for the server before giving up on a request
+    :type timeout: float
+    :param pool_maxsize: Maximum number of simultaneous HTTP connections
+    :type pool_maxsize: int
+    """
+
+    def __init__(self, base_url, api_key, timeout=5, pool_maxsize=10):
+        self._base_url = base_url
+        self._headers = bot_api_headers(api_key)
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._pool_maxsize = pool_maxsize
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """ Close all pooled connections held by the client """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_maxsize),
+                headers=self._headers, timeout=self._timeout)
+        return self._session
+
+    async def request(self, endpoint, method='GET', payload=None):
+        """ Make a request to the bot API, see :meth:`totv.tracker.BotAPIClient.request`
+
+        :return: Decoded response
+        :rtype: dict
+        """
+        kwargs = {}
+        if payload is not None:
+            kwargs['data' if isinstance(payload, (str, bytes)) else 'json'] = payload
+        async with self._get_session().request(method, self._base_url + endpoint,
+                                               **kwargs) as resp:
+            return jsonutil.loads(await resp.read())
+
+    async def batch(self, calls, concurrency=None):
+        """ Send many requests concurrently, see :meth:`totv.tracker.BotAPIClient.batch`
+
+        :return: Response or exception for each call, in the same order as calls
+        :rtype: list
+        """
+        semaphore = asyncio.Semaphore(max(concurrency or self._pool_maxsize, 1))
+
+        async def run(call):
+            async with semaphore:
+                try:
+                    return await call_item(self.request, call)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+                    return err
+
+        return await asyncio.gather(*[run(call) for call in calls])
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Caches used by the tracker clients
+"""
+from __future__ import unicode_literals, absolute_import
+from collections import OrderedDict
+from threading import Event, Lock
+import json
+import time
+
+# Returned by LRUCache.get when no value is cached, since None is a valid cached value
+MISSING = object()
+
+
+class LRUCache(object):
+    """ A thread safe, size bounded cache with an optional time to live for each entry. When
+    full the least recently used entry is evicted.
+
+    :param maxsize: Maximum number of entries held
+    :type maxsize: int
+    :param ttl: Seconds an entry stays valid, None to never expire
+    :type ttl: float
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def get(self, key, default=MISSING):
+        """ Fetch a cached value, marking it as recently used
+
+        :param key: Cache key
+        :param default: Value returned when the key is not cached or has expired
+        :return: Cached value or default
+        """
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """ Cache a value, evicting the least recently used entry if the cache is full
+
+        :param key: Cache key
+        :param value: Value to store
+        :param ttl: Override the default ttl for this entry
+        :type ttl: float
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def replace(self, key, value):
+        """ Replace the value of a cached entry while keeping its original expiry, so an
+        entry that keeps being replaced still expires on time
+
+        :param key: Cache key
+        :param value: New value
+        :return: False if the key was not cached or had expired
+        :rtype: bool
+        """
+        with self._lock:
+            try:
+                expires, _ = self._data[key]
+            except KeyError:
+                return False
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return False
+            self._data[key] = (expires, value)
+            return True
+
+    def delete(self, key):
+        """ Remove a key from the cache if present
+
+        :param key: Cache key
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """ Remove every entry from the cache """
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache(object):
+    """ A cache backend shared between processes using redis. Values are stored JSON encoded
+    so only JSON serialisable values can be cached.
+
+    :param client: Redis client used for storage
+    :type client: redis.StrictRedis
+    :param prefix: Prefix applied to every key
+    :type prefix: str
+    :param ttl: Default seconds an entry stays valid
+    :type ttl: float
+    """
+
+    def __init__(self, client, prefix="totv:cache:", ttl=5):
+        self._redis = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key, default=MISSING):
+        value = self._redis.get(self.prefix + key)
+        if value is None:
+            return default
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._redis.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + key)
+
+
+class SingleFlight(object):
+    """ Coalesce concurrent calls sharing the same key so only the first caller does the
+    work, every other caller blocks until it is done and receives the same result or
+    exception.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """ Call func, or wait for an identical in-flight call to finish
+
+        :param key: Key identifying identical calls
+        :param func: Function producing the result
+        :type func: callable
+        :return: Result of func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class CacheStats(object):
+    """ Hit and miss counters for a single cached endpoint """
+
+    __slots__ = ('hits', 'misses')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self):
+        return "<CacheStats(hits={}, misses={})>".format(self.hits, self.misses)
+
+
+# Seconds each read only tracker endpoint can be served from the cache
+DEFAULT_TTLS = {
+    'version': 300,
+    'uptime': 5,
+    'torrent_get': 5,
+    'get_torrent_peers': 5,
+    'get_torrent_counts': 10
+}
+
+
+class ResponseCache(object):
+    """ Caches the decoded responses of read only tracker endpoints. Concurrent misses for
+    the same key are coalesced so a burst of identical lookups costs a single upstream
+    request. Cached values are shared between callers and must be treated as read only.
+
+    >>> cache = ResponseCache(ttls={'get_torrent_peers': 2})
+    >>> client = Client(api_uri, response_cache=cache)
+    >>> cache.stats['get_torrent_peers'].hits
+
+    :param backend: Storage backend, an in-process LRUCache is used by default
+    :type backend: LRUCache, RedisCache
+    :param ttls: Seconds each endpoint is cached for, endpoints not listed are not cached
+    :type ttls: dict
+    :param maxsize: Size of the default in-process backend
+    :type maxsize: int
+    """
+
+    def __init__(self, backend=None, ttls=None, maxsize=4096):
+        self.backend = backend if backend is not None else LRUCache(maxsize)
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.stats = {endpoint: CacheStats() for endpoint in self.ttls}
+        self._flight = SingleFlight()
+        self._lock = Lock()
+
+    def get_or_fetch(self, endpoint, key, fetch):
+        """ Return the cached value for an endpoint, calling fetch on a miss
+
+        :param endpoint: Endpoint name used to look up the ttl and stats
+        :type endpoint: str
+        :param key: Cache key unique to the request
+        :type key: str
+        :param fetch: Function performing the upstream request
+        :type fetch: callable
+        :return: Cached or freshly fetched value
+        """
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return fetch()
+        stats = self.stats[endpoint]
+        value = self.backend.get(key)
+        if value is not MISSING:
+            with self._lock:
+                stats.hits += 1
+            return value
+        with self._lock:
+            stats.misses += 1
+
+        def load():
+            # Another caller may have filled the cache while this one was missing
+            result = self.backend.get(key)
+            if result is not MISSING:
+                return result
+            result = fetch()
+            self.backend.set(key, result, ttl=ttl)
+            return result
+        return self._flight.do(key, load)
+
+    def invalidate(self, key):
+        """ Drop a cached response
+
+        :param key: Cache key unique to the request
+        :type key: str
+        """
+        self.backend.delete(key)
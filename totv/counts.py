@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar snapshots of the tracker torrent counts.
+
+The counts for every torrent are stored as typed numpy arrays instead of a list of dicts,
+a single row costs 40 bytes, so aggregations over the entire tracker are vectorised and
+a snapshot of a million torrents stays around 40MB.
+
+>>> snap = CountsSnapshot.from_iter(client.iter_torrent_counts())
+>>> snap.totals()
+{'torrents': 1523, 'seeders': 8841, 'leechers': 212, 'snatches': 90412}
+>>> for row in snap.top(10, by="leechers"):
+>>>     print(row.torrent_id, row.leechers)
+
+"""
+from __future__ import unicode_literals, absolute_import
+from array import array
+from binascii import unhexlify
+from os.path import exists
+import os
+import time
+import numpy as np
+from totv.records import TorrentCounts
+
+COUNT_FIELDS = ('seeders', 'leechers', 'snatches')
+
+# Change types emitted when iterating over a CountsDiff
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+_id_dtype = np.int64
+_count_dtype = np.int32
+# Void rather than S20 so info hashes ending in null bytes are not truncated
+_ih_dtype = np.dtype("V20")
+
+
+class CountsSnapshot(object):
+    """ Columnar torrent counts, torrent ids are expected to be unique
+
+    :param torrent_ids: Torrent ids
+    :type torrent_ids: numpy.ndarray
+    :param info_hashes: Raw 20 byte info hashes
+    :type info_hashes: numpy.ndarray
+    :param seeders: Seeder counts
+    :type seeders: numpy.ndarray
+    :param leechers: Leecher counts
+    :type leechers: numpy.ndarray
+    :param snatches: Snatch counts
+    :type snatches: numpy.ndarray
+    :param taken_on: Unix timestamp the snapshot was taken
+    :type taken_on: float
+    """
+
+    __slots__ = ('torrent_ids', 'info_hashes', 'seeders', 'leechers', 'snatches', 'taken_on')
+
+    def __init__(self, torrent_ids, info_hashes, seeders, leechers, snatches, taken_on=None):
+        self.torrent_ids = np.asarray(torrent_ids, dtype=_id_dtype)
+        self.info_hashes = np.asarray(info_hashes, dtype=_ih_dtype)
+        self.seeders = np.asarray(seeders, dtype=_count_dtype)
+        self.leechers = np.asarray(leechers, dtype=_count_dtype)
+        self.snatches = np.asarray(snatches, dtype=_count_dtype)
+        self.taken_on = time.time() if taken_on is None else taken_on
+
+    @classmethod
+    def from_counts(cls, counts, taken_on=None):
+        """ Build a snapshot from the output of :meth:`totv.tracker.Client.get_torrent_counts`
+
+        :param counts: Count dicts or :class:`totv.records.TorrentCounts` records
+        :type counts: list
+        :param taken_on: Unix timestamp the counts were fetched
+        :type taken_on: float
+        :rtype: CountsSnapshot
+        """
+        n = len(counts)
+        if n and not isinstance(counts[0], dict):
+            counts = [c.to_dict() for c in counts]
+        return cls(
+            np.fromiter((c['torrent_id'] for c in counts), _id_dtype, n),
+            np.frombuffer(b"".join(unhexlify(c['info_hash']) for c in counts), _ih_dtype),
+            np.fromiter((c['seeders'] for c in counts), _count_dtype, n),
+            np.fromiter((c['leechers'] for c in counts), _count_dtype, n),
+            np.fromiter((c['snatches'] for c in counts), _count_dtype, n),
+            taken_on=taken_on
+        )
+
+    @classmethod
+    def from_iter(cls, counts, taken_on=None):
+        """ Build a snapshot from a stream of counts, such as
+        :meth:`totv.tracker.Client.iter_torrent_counts`. Rows are packed into typed buffers
+        as they arrive so the full list of dicts is never held in memory.
+
+        :param counts: Count dicts or :class:`totv.records.TorrentCounts` records
+        :type counts: iterable
+        :param taken_on: Unix timestamp the counts were fetched
+        :type taken_on: float
+        :rtype: CountsSnapshot
+        """
+        torrent_ids = array("q")
+        info_hashes = bytearray()
+        seeders, leechers, snatches = array("i"), array("i"), array("i")
+        for c in counts:
+            if not isinstance(c, dict):
+                c = c.to_dict()
+            torrent_ids.append(c['torrent_id'])
+            info_hashes += unhexlify(c['info_hash'])
+            seeders.append(c['seeders'])
+            leechers.append(c['leechers'])
+            snatches.append(c['snatches'])
+        return cls(torrent_ids, np.frombuffer(info_hashes, _ih_dtype), seeders, leechers,
+                   snatches, taken_on=taken_on)
+
+    @classmethod
+    def empty(cls):
+        """ An empty snapshot, useful as a starting point for diffs
+
+        :rtype: CountsSnapshot
+        """
+        return cls([], [], [], [], [], taken_on=0)
+
+    def __len__(self):
+        return len(self.torrent_ids)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    @property
+    def nbytes(self):
+        """ Total size of the backing arrays in bytes """
+        return sum(getattr(self, f).nbytes for f in ('torrent_ids', 'info_hashes') + COUNT_FIELDS)
+
+    def row(self, i):
+        """ Get a single row as a record
+
+        :param i: Row index
+        :type i: int
+        :rtype: TorrentCounts
+        """
+        return TorrentCounts(int(self.torrent_ids[i]), self.info_hashes[i].tobytes().hex(),
+                             int(self.seeders[i]), int(self.leechers[i]), int(self.snatches[i]))
+
+    def take(self, index):
+        """ Select a subset of rows
+
+        :param index: Integer indices or boolean mask
+        :type index: numpy.ndarray
+        :rtype: CountsSnapshot
+        """
+        return CountsSnapshot(self.torrent_ids[index], self.info_hashes[index],
+                              self.seeders[index], self.leechers[index], self.snatches[index],
+                              taken_on=self.taken_on)
+
+    def to_counts(self):
+        """ Convert back into the list of dicts returned by the tracker
+
+        :rtype: []dict
+        """
+        return [row.to_dict() for row in self]
+
+    def totals(self):
+        """ Sum of every count column across all torrents
+
+        :rtype: dict
+        """
+        totals = {field: int(getattr(self, field).sum(dtype=np.int64)) for field in COUNT_FIELDS}
+        totals['torrents'] = len(self)
+        return totals
+
+    def top(self, n=10, by="seeders"):
+        """ Get the n torrents with the highest value for a count column, highest first
+
+        :param n: Number of torrents to return
+        :type n: int
+        :param by: Count column to rank by, one of seeders, leechers or snatches
+        :type by: str
+        :rtype: CountsSnapshot
+        """
+        values = self._column(by)
+        n = min(n, len(values))
+        if n <= 0:
+            return self.take(np.array([], dtype=np.intp))
+        idx = np.argpartition(-values.astype(np.int64), n - 1)[:n]
+        idx = idx[np.argsort(-values[idx].astype(np.int64), kind="stable")]
+        return self.take(idx)
+
+    def dead(self, min_seeders=1):
+        """ Get the torrents with less than min_seeders seeders
+
+        :param min_seeders: Seeder count a torrent needs to be considered alive
+        :type min_seeders: int
+        :rtype: CountsSnapshot
+        """
+        return self.take(self.seeders < min_seeders)
+
+    def diff(self, newer):
+        """ Compute the changes between this snapshot and a newer one
+
+        :param newer: The more recent snapshot
+        :type newer: CountsSnapshot
+        :rtype: CountsDiff
+        """
+        return CountsDiff(self, newer)
+
+    def save(self, path):
+        """ Persist the snapshot to disk as an uncompressed .npz archive. The archive is
+        written to a temporary file first and moved into place so an interrupted save never
+        leaves a truncated file behind.
+
+        :param path: File path to write to, used as is even without a .npz extension
+        :type path: str
+        """
+        tmp = "{}.tmp".format(path)
+        # savez appends .npz to file names without it, an open file is written as is
+        with open(tmp, "wb") as fp:
+            np.savez(fp, taken_on=np.float64(self.taken_on), **{
+                f: getattr(self, f) for f in ('torrent_ids', 'info_hashes') + COUNT_FIELDS})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a snapshot previously written with :meth:`save`
+
+        :param path: File path to read from
+        :type path: str
+        :rtype: CountsSnapshot
+        """
+        with np.load(path) as data:
+            return cls(data['torrent_ids'], data['info_hashes'], data['seeders'],
+                       data['leechers'], data['snatches'], taken_on=float(data['taken_on']))
+
+    def _column(self, field):
+        if field not in COUNT_FIELDS:
+            raise ValueError("Unknown count field: {}".format(field))
+        return getattr(self, field)
+
+
+class CountsDiff(object):
+    """ Per torrent differences between two snapshots, matched by torrent_id
+
+    :ivar added: Torrents only present in the newer snapshot
+    :ivar removed: Torrents only present in the older snapshot
+    :ivar changed: New values of the torrents whose counts changed
+    :ivar seeders: Seeder delta for each changed torrent
+    :ivar leechers: Leecher delta for each changed torrent
+    :ivar snatches: Snatch delta for each changed torrent
+    """
+
+    __slots__ = ('added', 'removed', 'changed', 'seeders', 'leechers', 'snatches')
+
+    def __init__(self, older, newer):
+        common, old_idx, new_idx = np.intersect1d(older.torrent_ids, newer.torrent_ids,
+                                                  assume_unique=True, return_indices=True)
+        self.added = newer.take(~np.isin(newer.torrent_ids, common, assume_unique=True))
+        self.removed = older.take(~np.isin(older.torrent_ids, common, assume_unique=True))
+        deltas = [getattr(newer, f)[new_idx] - getattr(older, f)[old_idx] for f in COUNT_FIELDS]
+        mask = (deltas[0] != 0) | (deltas[1] != 0) | (deltas[2] != 0)
+        self.changed = newer.take(new_idx[mask])
+        self.seeders, self.leechers, self.snatches = (d[mask] for d in deltas)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        """ Iterate over every change as (change_type, row) tuples, rows hold the new values
+        for added and changed torrents and the last known values for removed torrents
+        """
+        for change_type, snapshot in ((ADDED, self.added), (CHANGED, self.changed),
+                                      (REMOVED, self.removed)):
+            for row in snapshot:
+                yield change_type, row
+
+    def totals(self):
+        """ Net change of every count column, including added and removed torrents
+
+        :rtype: dict
+        """
+        totals = {}
+        for field in COUNT_FIELDS:
+            totals[field] = (int(getattr(self, field).sum(dtype=np.int64)) +
+                             int(getattr(self.added, field).sum(dtype=np.int64)) -
+                             int(getattr(self.removed, field).sum(dtype=np.int64)))
+        totals['torrents'] = len(self.added) - len(self.removed)
+        return totals
+
+
+class CountsSync(object):
+    """ Stateful helper that polls the tracker counts and only emits what changed since
+    the previous poll. The first poll reports every torrent as added.
+
+    >>> sync = CountsSync(client, state_path="counts.npz")
+    >>> for change_type, row in sync.poll():
+    >>>     if change_type == REMOVED:
+    >>>         db.delete_counts(row.torrent_id)
+    >>>     else:
+    >>>         db.update_counts(row.torrent_id, row.seeders, row.leechers, row.snatches)
+
+    :param client: Tracker client, either sync or async
+    :type client: totv.tracker.Client, totv.aiotracker.AsyncClient
+    :param snapshot: Previous snapshot to compute the first diff against
+    :type snapshot: CountsSnapshot
+    :param state_path: Optional path used to persist the last snapshot between runs
+    :type state_path: str
+    """
+
+    def __init__(self, client, snapshot=None, state_path=None):
+        self._client = client
+        self._state_path = state_path
+        if snapshot is None and state_path and exists(state_path):
+            snapshot = CountsSnapshot.load(state_path)
+        self.snapshot = snapshot if snapshot is not None else CountsSnapshot.empty()
+
+    def poll(self):
+        """ Fetch the current counts and diff them against the last snapshot
+
+        :rtype: CountsDiff
+        """
+        return self.update(self._client.get_torrent_counts_snapshot())
+
+    async def poll_async(self):
+        """ Coroutine version of :meth:`poll` for use with an async client
+
+        :rtype: CountsDiff
+        """
+        return self.update(await self._client.get_torrent_counts_snapshot())
+
+    def update(self, snapshot):
+        """ Diff a new snapshot against the last one and keep it as the new baseline
+
+        :param snapshot: Latest snapshot
+        :type snapshot: CountsSnapshot
+        :rtype: CountsDiff
+        """
+        diff = self.snapshot.diff(snapshot)
+        self.snapshot = snapshot
+        if self._state_path:
+            self.snapshot.save(self._state_path)
+        return diff
+
+    def reset(self):
+        """ Forget the last snapshot so the next poll reports everything as added """
+        self.snapshot = CountsSnapshot.empty()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+External merge sort used to produce ordered exports that are too large to sort in memory.
+
+Items are collected into sorted runs of a fixed size which are spilled to temporary files,
+the runs are then lazily merged back together. Only one run plus a single item from each
+spilled run is held in memory at any time.
+
+>>> for user in external_sort(client.iter_users_redis(), key=lambda u: u['user_id']):
+>>>     writer.writerow(user)
+
+"""
+from __future__ import unicode_literals, absolute_import
+import heapq
+import pickle
+import tempfile
+
+
+def external_sort(iterable, key=None, reverse=False, chunk_size=100000, tmp_dir=None):
+    """ Lazily sort an iterable of picklable items using bounded memory
+
+    If the input fits in a single chunk it is sorted in memory and no files are created.
+
+    :param iterable: Items to sort
+    :type iterable: iterable
+    :param key: Key function used to order the items
+    :type key: callable
+    :param reverse: Sort in descending order
+    :type reverse: bool
+    :param chunk_size: Maximum number of items held in memory in a single sorted run
+    :type chunk_size: int
+    :param tmp_dir: Directory used for the spilled runs, defaults to the system temp dir
+    :type tmp_dir: str
+    :return: Generator of sorted items
+    :rtype: generator
+    """
+    runs = []
+    chunk = []
+    try:
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                chunk.sort(key=key, reverse=reverse)
+                runs.append(_spill(chunk, tmp_dir))
+                chunk = []
+        chunk.sort(key=key, reverse=reverse)
+        if not runs:
+            yield from chunk
+            return
+        iterables = [_read_run(run) for run in runs]
+        iterables.append(chunk)
+        yield from heapq.merge(*iterables, key=key, reverse=reverse)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _spill(items, tmp_dir=None):
+    run = tempfile.TemporaryFile(dir=tmp_dir)
+    pickler = pickle.Pickler(run, protocol=pickle.HIGHEST_PROTOCOL)
+    for item in items:
+        pickler.dump(item)
+        # Pickler otherwise keeps a reference to every item it has written
+        pickler.clear_memo()
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    unpickler = pickle.Unpickler(run)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
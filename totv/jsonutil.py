@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+JSON decoding helpers for large tracker responses.
+
+:func:`loads` uses the fastest JSON parser installed (orjson, then ujson) and falls back to
+the stdlib json module. :func:`iter_array` incrementally parses a top level JSON array
+from a stream of chunks, yielding each element without building the full document.
+"""
+from __future__ import unicode_literals, absolute_import
+import codecs
+import json
+
+try:
+    import orjson as _fast_json
+except ImportError:
+    try:
+        import ujson as _fast_json
+    except ImportError:
+        _fast_json = None
+
+# Name of the parser used by loads, mostly useful for logging
+parser = _fast_json.__name__ if _fast_json is not None else "json"
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r"
+_delimiters = _whitespace + ",]"
+
+
+def loads(data):
+    """ Decode a JSON document
+
+    :param data: Encoded JSON document
+    :type data: bytes, str
+    :return: Decoded document
+    """
+    if _fast_json is not None:
+        return _fast_json.loads(data)
+    return json.loads(data)
+
+
+def iter_array(chunks, encoding="utf-8"):
+    """ Incrementally parse a top level JSON array, yielding each element as soon as it
+    has been fully received. Only the element currently being parsed is buffered.
+
+    >>> resp = requests.get(url, stream=True)
+    >>> for row in iter_array(resp.iter_content(65536)):
+    >>>     process(row)
+
+    :param chunks: Chunks of the encoded document
+    :type chunks: iterable
+    :param encoding: Encoding used for byte chunks
+    :type encoding: str
+    :raises ValueError: The document is not a JSON array
+    :return: Generator of decoded array elements
+    :rtype: generator
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buf = ""
+    pos = 0
+    started = False
+    done = False
+    chunks = iter(chunks)
+    while not done:
+        chunk = next(chunks, None)
+        final = chunk is None
+        if final:
+            buf = buf[pos:] + decoder.decode(b"", final=True)
+        elif isinstance(chunk, bytes):
+            buf = buf[pos:] + decoder.decode(chunk)
+        else:
+            buf = buf[pos:] + chunk
+        pos = 0
+        while True:
+            pos = _skip_whitespace(buf, pos)
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                done = True
+                break
+            if buf[pos] == ",":
+                pos += 1
+                continue
+            try:
+                element, end = _decoder.raw_decode(buf, pos)
+            except ValueError:
+                if final:
+                    raise
+                # Element not fully received yet
+                break
+            # A number may continue in the next chunk, "5." and "1e" decode as 5 and 1, so
+            # wait until the element is followed by a delimiter
+            if not final and (end >= len(buf) or buf[end] not in _delimiters):
+                break
+            yield element
+            pos = end
+        if final and not done:
+            raise ValueError("Unterminated JSON array")
+
+
+def _skip_whitespace(buf, pos):
+    while pos < len(buf) and buf[pos] in _whitespace:
+        pos += 1
+    return pos
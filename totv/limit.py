@@ -1,11 +1,15 @@
 # coding=utf-8
+from collections import OrderedDict
+from threading import Lock
+import asyncio
 import functools
 import time
 
 
 class RateLimit(object):
     """ Rate limit decorator used to restrict functions from being executed
-    based on numbers of requests allowed within a defined window.
+    based on numbers of requests allowed within a defined window. All callers share a
+    single allowance, see :class:`KeyedRateLimit` to limit per user or channel.
 
     >>> @RateLimit
     >>> def test():
@@ -33,6 +37,7 @@ class RateLimit(object):
         self.window = window
         self.allowance = rate
         self.last_check = time.time()
+        self._lock = Lock()
         functools.update_wrapper(self, wrapped)
 
     def is_allowed(self):
@@ -41,17 +46,18 @@ class RateLimit(object):
         :return: Allow or reject a call
         :rtype: bool
         """
-        current = time.time()
-        time_passed = current - self.last_check
-        self.last_check = current
-        self.allowance += time_passed * (self.rate / self.window)
-        if self.allowance > self.rate:
-            self.allowance = self.rate
-        if self.allowance < 1.0:
-            return False
-        else:
-            self.allowance -= 1
-            return True
+        with self._lock:
+            current = time.time()
+            time_passed = current - self.last_check
+            self.last_check = current
+            self.allowance += time_passed * (self.rate / self.window)
+            if self.allowance > self.rate:
+                self.allowance = self.rate
+            if self.allowance < 1.0:
+                return False
+            else:
+                self.allowance -= 1
+                return True
 
     def __call__(self, *args, **kwargs):
         if self.is_allowed():
@@ -59,3 +65,112 @@ class RateLimit(object):
         else:
             args[0].say("Rate limit hit, +1 autisms")
 
+
+class KeyedRateLimit(object):
+    """ Thread safe rate limit decorator keeping a separate allowance for every key, eg: per
+    user, channel or host, so one noisy user does not block a command for everyone else.
+    Works with both regular functions and coroutine functions.
+
+    >>> def reject(bot, trigger):
+    >>>     bot.notice("Slow down", trigger.nick)
+    >>>
+    >>> @KeyedRateLimit(rate=2, window=120, key=lambda bot, trigger: trigger.host,
+    >>>                 on_reject=reject)
+    >>> def command(bot, trigger):
+    >>>     ...
+
+    Each key costs a single entry holding its allowance and last check time. Only the
+    max_keys most recently used keys are tracked, the least recently used key is evicted
+    beyond that and starts again with a full allowance when it returns.
+
+    :param rate: Number of calls allowed within the window
+    :type rate: int
+    :param window: Time in seconds to use as rate limit window
+    :type window: int
+    :param key: Function called with the decorated functions arguments returning the key
+        to limit by, all calls share a single key when not set
+    :type key: callable
+    :param max_keys: Maximum number of keys tracked
+    :type max_keys: int
+    :param on_reject: Called with the decorated functions arguments instead of it when a
+        call is rejected, its result is returned to the caller. Awaited when it returns an
+        awaitable and the decorated function is a coroutine function.
+    :type on_reject: callable
+    :param clock: Monotonic clock returning seconds
+    :type clock: callable
+    """
+
+    def __init__(self, rate=2, window=120, key=None, max_keys=100000, on_reject=None,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.window = window
+        self.key = key
+        self.max_keys = max_keys
+        self.on_reject = on_reject
+        self._clock = clock
+        # key -> [allowance, last_check], ordered from least to most recently used
+        self._state = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._state)
+
+    def is_allowed(self, key=None):
+        """ Determine if a call for a key should be allowed to proceed, using up part of the
+        keys allowance when it is.
+
+        :param key: Key to check
+        :return: Allow or reject a call
+        :rtype: bool
+        """
+        with self._lock:
+            current = self._clock()
+            state = self._state.get(key)
+            if state is None:
+                state = self._state[key] = [self.rate, current]
+                if len(self._state) > self.max_keys:
+                    self._state.popitem(last=False)
+            else:
+                self._state.move_to_end(key)
+                state[0] = min(self.rate,
+                               state[0] + (current - state[1]) * (self.rate / self.window))
+                state[1] = current
+            if state[0] < 1.0:
+                return False
+            state[0] -= 1
+            return True
+
+    def reset(self, key=None):
+        """ Forget the allowance of a key, or of every key
+
+        :param key: Key to reset, None for all keys
+        """
+        with self._lock:
+            if key is None:
+                self._state.clear()
+            else:
+                self._state.pop(key, None)
+
+    def _key(self, args, kwargs):
+        return self.key(*args, **kwargs) if self.key is not None else None
+
+    def __call__(self, wrapped):
+        if asyncio.iscoroutinefunction(wrapped):
+            @functools.wraps(wrapped)
+            async def wrapper(*args, **kwargs):
+                if self.is_allowed(self._key(args, kwargs)):
+                    return await wrapped(*args, **kwargs)
+                if self.on_reject is not None:
+                    result = self.on_reject(*args, **kwargs)
+                    if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                        result = await result
+                    return result
+        else:
+            @functools.wraps(wrapped)
+            def wrapper(*args, **kwargs):
+                if self.is_allowed(self._key(args, kwargs)):
+                    return wrapped(*args, **kwargs)
+                if self.on_reject is not None:
+                    return self.on_reject(*args, **kwargs)
+        wrapper.limiter = self
+        return wrapper
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Client side metrics for the tracker API.
+
+Every request made by :class:`totv.tracker.Client` and :class:`totv.aiotracker.AsyncClient`
+is recorded against its endpoint: number of calls, errors by exception class, bytes
+received and a latency histogram. Recording a call is a dict lookup, a bisect over the
+bucket bounds and a few additions under a lock.
+
+>>> client = Client(api_uri)
+>>> client.torrent_get(info_hash)
+>>> stats = client.metrics.stats["GET /torrent/{id}"]
+>>> stats.latency.quantile(0.99)
+0.0123
+
+Sinks receive every observation so the metrics can be exported elsewhere:
+
+>>> client.metrics.add_sink(StatsDSink("localhost", 8125))
+
+"""
+from __future__ import unicode_literals, absolute_import
+from bisect import bisect_left
+from threading import Lock
+import re
+import socket
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Ids in request paths are replaced so every torrent or user shares the same endpoint
+_path_ids = re.compile(r"^/(torrent|user|whitelist)/[^/]+")
+
+
+def endpoint_name(method, path):
+    """ Name a request is recorded under, eg: GET /torrent/{id}/peers
+
+    :param method: HTTP method
+    :type method: str
+    :param path: Request path
+    :type path: str
+    :rtype: str
+    """
+    return "{} {}".format(method.upper(), _path_ids.sub(r"/\1/{id}", path))
+
+
+class Histogram(object):
+    """ Fixed bucket histogram, quantiles are estimated by interpolating inside the bucket
+    they fall in.
+
+    :param buckets: Sorted upper bounds of the buckets
+    :type buckets: tuple
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is the overflow bucket for values above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """ Add a value to the histogram
+
+        :param value: Observed value
+        :type value: float
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """ Estimate a quantile
+
+        :param q: Quantile between 0 and 1, eg: 0.95
+        :type q: float
+        :return: Estimated value, 0.0 when empty
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else self.min
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+
+class EndpointStats(object):
+    """ Metrics of a single endpoint
+
+    :ivar calls: Number of requests made
+    :ivar errors: Number of failed requests by exception class name
+    :ivar bytes_received: Total size of the response bodies
+    :ivar latency: Request latency in seconds
+    """
+
+    __slots__ = ('calls', 'errors', 'bytes_received', 'latency')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.calls = 0
+        self.errors = {}
+        self.bytes_received = 0
+        self.latency = Histogram(buckets)
+
+    def to_dict(self):
+        latency = self.latency
+        return {
+            'calls': self.calls,
+            'errors': dict(self.errors),
+            'bytes_received': self.bytes_received,
+            'latency': {
+                'mean': latency.mean,
+                'p50': latency.quantile(0.5),
+                'p95': latency.quantile(0.95),
+                'p99': latency.quantile(0.99),
+                'max': latency.max or 0.0
+            }
+        }
+
+    def __repr__(self):
+        return "<EndpointStats(calls={}, errors={}, p50={:.4f}, p99={:.4f})>".format(
+            self.calls, sum(self.errors.values()), self.latency.quantile(0.5),
+            self.latency.quantile(0.99))
+
+
+class MetricsSink(object):
+    """ Base class for exporting observations, sinks are called synchronously after every
+    request so they must not block.
+    """
+
+    def observe(self, endpoint, elapsed, nbytes, error=None):
+        """ Called once for every request
+
+        :param endpoint: Endpoint name, see :func:`endpoint_name`
+        :type endpoint: str
+        :param elapsed: Request latency in seconds
+        :type elapsed: float
+        :param nbytes: Size of the response body
+        :type nbytes: int
+        :param error: Exception class name if the request failed
+        :type error: str
+        """
+        raise NotImplementedError()
+
+
+class StatsDSink(MetricsSink):
+    """ Send observations to a StatsD server over UDP
+
+    :param host: StatsD host
+    :type host: str
+    :param port: StatsD port
+    :type port: int
+    :param prefix: Prefix of every metric name
+    :type prefix: str
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="totv.tracker"):
+        self._addr = (host, port)
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._names = {}
+
+    def _name(self, endpoint):
+        name = self._names.get(endpoint)
+        if name is None:
+            name = self._names[endpoint] = "{}.{}".format(
+                self._prefix, re.sub(r"[^a-zA-Z0-9]+", "_", endpoint).strip("_").lower())
+        return name
+
+    def observe(self, endpoint, elapsed, nbytes, error=None):
+        name = self._name(endpoint)
+        lines = ["{}.calls:1|c".format(name),
+                 "{}.latency:{:.3f}|ms".format(name, elapsed * 1000),
+                 "{}.bytes:{}|c".format(name, nbytes)]
+        if error:
+            lines.append("{}.errors.{}:1|c".format(name, error))
+        try:
+            self._socket.sendto("\n".join(lines).encode(), self._addr)
+        except OSError:
+            pass
+
+
+class Metrics(object):
+    """ Thread safe per endpoint metrics, one instance can be shared by several clients
+
+    :param buckets: Latency histogram bucket bounds in seconds
+    :type buckets: tuple
+    :param sinks: Sinks receiving every observation
+    :type sinks: list
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, sinks=None):
+        self.buckets = buckets
+        self.stats = {}
+        self.sinks = list(sinks or [])
+        self._lock = Lock()
+
+    def add_sink(self, sink):
+        """ Register a sink
+
+        :param sink: Sink to call after every request
+        :type sink: MetricsSink
+        """
+        self.sinks.append(sink)
+
+    def record(self, endpoint, elapsed, nbytes=0, error=None):
+        """ Record a single request
+
+        :param endpoint: Endpoint name, see :func:`endpoint_name`
+        :type endpoint: str
+        :param elapsed: Request latency in seconds
+        :type elapsed: float
+        :param nbytes: Size of the response body
+        :type nbytes: int
+        :param error: Exception class name if the request failed
+        :type error: str
+        """
+        with self._lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                stats = self.stats[endpoint] = EndpointStats(self.buckets)
+            stats.calls += 1
+            stats.bytes_received += nbytes
+            stats.latency.observe(elapsed)
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+        for sink in self.sinks:
+            sink.observe(endpoint, elapsed, nbytes, error)
+
+    def reset(self):
+        """ Forget everything recorded so far """
+        with self._lock:
+            self.stats = {}
+
+    def snapshot(self):
+        """ Current metrics of every endpoint
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self.stats.items()}
+
+    def prometheus(self, prefix="totv_tracker"):
+        """ Render the metrics using the Prometheus text exposition format
+
+        :param prefix: Prefix of every metric name
+        :type prefix: str
+        :rtype: str
+        """
+        lines = [
+            "# TYPE {}_requests_total counter".format(prefix),
+            "# TYPE {}_errors_total counter".format(prefix),
+            "# TYPE {}_response_bytes_total counter".format(prefix),
+            "# TYPE {}_request_seconds histogram".format(prefix)
+        ]
+        with self._lock:
+            for endpoint, stats in sorted(self.stats.items()):
+                label = 'endpoint="{}"'.format(endpoint)
+                lines.append("{}_requests_total{{{}}} {}".format(prefix, label, stats.calls))
+                for error, n in sorted(stats.errors.items()):
+                    lines.append('{}_errors_total{{{},error="{}"}} {}'.format(
+                        prefix, label, error, n))
+                lines.append("{}_response_bytes_total{{{}}} {}".format(
+                    prefix, label, stats.bytes_received))
+                latency = stats.latency
+                total = 0
+                for bound, n in zip(latency.buckets + ("+Inf",), latency.counts):
+                    total += n
+                    lines.append('{}_request_seconds_bucket{{{},le="{}"}} {}'.format(
+                        prefix, label, bound, total))
+                lines.append("{}_request_seconds_sum{{{}}} {}".format(prefix, label, latency.sum))
+                lines.append("{}_request_seconds_count{{{}}} {}".format(
+                    prefix, label, latency.count))
+        return "\n".join(lines) + "\n"
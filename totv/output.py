@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Flood safe output queue for the bot.
+
+Messages are split into lines that fit within the IRC line limit, keeping their formatting
+across the breaks, then sent at a steady rate using a token bucket so the server never
+disconnects the bot for excess flood. While waiting to send, small messages queued for the
+same target are merged into a single line.
+
+>>> queue = OutputQueue(bot.msg)
+>>> queue.start()
+>>> queue.put("#announce", render("New Torrent", items))
+>>> queue.stop(flush=True)
+
+"""
+from __future__ import unicode_literals, absolute_import
+from collections import OrderedDict, deque
+from threading import Condition, Lock, Thread
+import logging
+import time
+from totv.theme import MAX_MESSAGE_BYTES, NORMAL, get_value, split_message
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """ Thread safe token bucket, tokens are refilled at a constant rate up to the burst size
+
+    :param rate: Tokens added every second
+    :type rate: float
+    :param burst: Maximum number of tokens held
+    :type burst: int
+    :param clock: Monotonic clock returning seconds
+    :type clock: callable
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._clock = clock
+        self._last = clock()
+        self._lock = Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, tokens=1):
+        """ Take tokens from the bucket if enough are available
+
+        :param tokens: Number of tokens to take
+        :type tokens: int
+        :return: Seconds to wait before enough tokens are available, 0 if they were taken
+        :rtype: float
+        """
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def refund(self, tokens=1):
+        """ Return tokens that were taken but not used """
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + tokens)
+
+
+class OutputQueue(object):
+    """ Queue of outgoing messages sent at a flood safe rate
+
+    Targets are served round robin so a long message to one channel does not hold back the
+    others. Lines are sent by calling send(target, line) from the queue's thread, or from the
+    caller's thread when using :meth:`send_next` directly.
+
+    :param send: Function sending a single line to a target
+    :type send: callable
+    :param rate: Lines sent per second once the burst is used up
+    :type rate: float
+    :param burst: Number of lines that can be sent back to back
+    :type burst: int
+    :param max_bytes: Maximum length of a line in encoded bytes
+    :type max_bytes: int
+    :param merge: Merge consecutive single line messages to the same target when they fit
+    :type merge: bool
+    :param merge_sep: Separator between merged messages, defaults to the theme sep_char
+    :type merge_sep: str
+    :param max_queue: Maximum number of lines queued per target, the oldest lines are
+        dropped when full
+    :type max_queue: int
+    :param encoding: Encoding the lines are sent with
+    :type encoding: str
+    """
+
+    def __init__(self, send, rate=0.5, burst=5, max_bytes=MAX_MESSAGE_BYTES, merge=True,
+                 merge_sep=None, max_queue=1000, encoding="utf-8"):
+        self._send = send
+        self._bucket = TokenBucket(rate, burst)
+        self.max_bytes = max_bytes
+        self.merge = merge
+        self.merge_sep = merge_sep
+        self.max_queue = max_queue
+        self.encoding = encoding
+        self.sent = 0
+        self.dropped = 0
+        self._queues = OrderedDict()
+        self._cond = Condition()
+        self._thread = None
+        self._running = False
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def put(self, target, message):
+        """ Queue a message, splitting it into as many lines as needed
+
+        :param target: Channel or nick to send to
+        :type target: str
+        :param message: Rendered message
+        :type message: str
+        """
+        lines = split_message(message, self.max_bytes, self.encoding)
+        # Only whole messages are merged, parts of a split message are sent as they are
+        mergeable = len(lines) == 1
+        with self._cond:
+            queue = self._queues.get(target)
+            if queue is None:
+                queue = self._queues[target] = deque()
+            queue.extend((line, mergeable) for line in lines)
+            while len(queue) > self.max_queue:
+                queue.popleft()
+                self.dropped += 1
+            self._cond.notify_all()
+
+    def _pop(self):
+        target, queue = next(iter(self._queues.items()))
+        line, mergeable = queue.popleft()
+        if self.merge and mergeable:
+            sep = self.merge_sep if self.merge_sep is not None else get_value("sep_char")
+            while queue and queue[0][1]:
+                merged = "".join([line, NORMAL, sep, queue[0][0]])
+                if len(merged.encode(self.encoding)) > self.max_bytes:
+                    break
+                line = merged
+                queue.popleft()
+        if queue:
+            self._queues.move_to_end(target)
+        else:
+            del self._queues[target]
+        return target, line
+
+    def send_next(self, block=True):
+        """ Send the next line once the rate limit allows it
+
+        :param block: Wait for the rate limit instead of returning straight away
+        :type block: bool
+        :return: True if a line was sent
+        :rtype: bool
+        """
+        return self._send_next(block)
+
+    def _send_next(self, block=True, worker=False):
+        # The background thread gives up as soon as the queue is stopped
+        while True:
+            with self._cond:
+                if not self._queues or (worker and not self._running):
+                    return False
+            wait = self._bucket.consume()
+            if not wait:
+                break
+            if not block:
+                return False
+            # Anything queued meanwhile can still be merged into the line, stop() wakes
+            # the wait early
+            with self._cond:
+                self._cond.wait(wait)
+        with self._cond:
+            if not self._queues or (worker and not self._running):
+                # Emptied by another thread or stopped, give the token back
+                self._bucket.refund()
+                return False
+            target, line = self._pop()
+        self._send(target, line)
+        self.sent += 1
+        return True
+
+    def flush(self):
+        """ Send every queued line from the calling thread, respecting the rate limit """
+        while self.send_next():
+            pass
+
+    def clear(self, target=None):
+        """ Drop the queued lines of a target, or of every target
+
+        :param target: Channel or nick, None for all
+        :type target: str
+        """
+        with self._cond:
+            if target is None:
+                self._queues.clear()
+            else:
+                self._queues.pop(target, None)
+
+    def start(self):
+        """ Start sending queued lines from a background thread """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, name="totv-output", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush=False, timeout=None):
+        """ Stop the background thread
+
+        :param flush: Send the remaining lines before stopping
+        :type flush: bool
+        :param timeout: Seconds to wait for the thread to finish
+        :type timeout: float
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if flush:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queues:
+                    self._cond.wait()
+                if not self._running:
+                    return
+            try:
+                self._send_next(worker=True)
+            except Exception:
+                logger.exception("Failed to send line")
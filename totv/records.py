@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Compact record types for the entities returned by the tracker. They use __slots__ so a
+record costs a fraction of the equivalent dict, which matters when loading millions of
+users or torrents at once.
+
+>>> users = client.users_get_all_redis(records=True)
+>>> users[0].uploaded
+1024
+
+"""
+from __future__ import unicode_literals, absolute_import
+
+
+class Record(object):
+    """ Base class for the slotted tracker records """
+    __slots__ = ()
+
+    def to_dict(self):
+        """ Convert the record into a plain dict
+
+        :return: Record fields and values
+        :rtype: dict
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "<{}({})>".format(self.__class__.__name__, ", ".join(
+            "{}={}".format(name, repr(getattr(self, name))) for name in self.__slots__))
+
+
+class User(Record):
+    __slots__ = ('user_id', 'username', 'passkey', 'uploaded', 'downloaded', 'enabled',
+                 'can_leech')
+
+    def __init__(self, user_id, username, passkey, uploaded=0, downloaded=0, enabled=True,
+                 can_leech=True):
+        self.user_id = user_id
+        self.username = username
+        self.passkey = passkey
+        self.uploaded = uploaded
+        self.downloaded = downloaded
+        self.enabled = enabled
+        self.can_leech = can_leech
+
+    @classmethod
+    def from_redis(cls, data):
+        """ Build a user from a raw redis hash, missing fields use the same placeholders
+        as :func:`totv.tracker.user_from_redis`
+
+        :param data: Raw user hash as returned by HGETALL
+        :type data: dict
+        :rtype: User
+        """
+        get = data.get
+        return cls(
+            int(get(b'user_id', b"-1")),
+            get(b'username', b"ERROR: NO USER!").decode(),
+            get(b'passkey', b"ERROR: PASSKEY NOT SET").decode(),
+            int(get(b'uploaded', b"-1")),
+            int(get(b'downloaded', b"-1")),
+            get(b'enabled', b"0") == b"1",
+            get(b'can_leech', b"1") == b"1"
+        )
+
+    @classmethod
+    def from_json(cls, data):
+        """ Build a user from a decoded tracker API response
+
+        :param data: User as returned by the /user/{id} endpoint
+        :type data: dict
+        :rtype: User
+        """
+        return cls(data['user_id'], data['username'], data['passkey'], data.get('uploaded', 0),
+                   data.get('downloaded', 0), data.get('enabled', True), data.get('can_leech', True))
+
+
+class Torrent(Record):
+    __slots__ = ('torrent_id', 'info_hash', 'name', 'seeders', 'leechers', 'snatches',
+                 'uploaded', 'downloaded', 'announces')
+
+    def __init__(self, torrent_id, info_hash, name="", seeders=0, leechers=0, snatches=0,
+                 uploaded=0, downloaded=0, announces=0):
+        self.torrent_id = torrent_id
+        self.info_hash = info_hash
+        self.name = name
+        self.seeders = seeders
+        self.leechers = leechers
+        self.snatches = snatches
+        self.uploaded = uploaded
+        self.downloaded = downloaded
+        self.announces = announces
+
+    @classmethod
+    def from_redis(cls, data, info_hash=None):
+        """ Build a torrent from a raw redis hash
+
+        :param data: Raw torrent hash as returned by HGETALL
+        :type data: dict
+        :param info_hash: Info hash taken from the redis key, used if absent from the hash
+        :type info_hash: str
+        :rtype: Torrent
+        """
+        get = data.get
+        if b'info_hash' in data:
+            info_hash = data[b'info_hash'].decode()
+        return cls(
+            int(get(b'torrent_id', b"-1")),
+            info_hash,
+            get(b'name', b"").decode(),
+            int(get(b'seeders', b"0")),
+            int(get(b'leechers', b"0")),
+            int(get(b'snatches', b"0")),
+            int(get(b'uploaded', b"0")),
+            int(get(b'downloaded', b"0")),
+            int(get(b'announces', b"0"))
+        )
+
+    @classmethod
+    def from_json(cls, data):
+        """ Build a torrent from a decoded tracker API response
+
+        :param data: Torrent as returned by the /torrent/{info_hash} endpoint
+        :type data: dict
+        :rtype: Torrent
+        """
+        get = data.get
+        return cls(data['torrent_id'], data['info_hash'], get('name', ""), get('seeders', 0),
+                   get('leechers', 0), get('snatches', 0), get('uploaded', 0),
+                   get('downloaded', 0), get('announces', 0))
+
+
+class Peer(Record):
+    __slots__ = ('peer_id', 'ip', 'port', 'uploaded', 'downloaded', 'left', 'user_id')
+
+    def __init__(self, peer_id, ip, port, uploaded=0, downloaded=0, left=0, user_id=None):
+        self.peer_id = peer_id
+        self.ip = ip
+        self.port = port
+        self.uploaded = uploaded
+        self.downloaded = downloaded
+        self.left = left
+        self.user_id = user_id
+
+    @classmethod
+    def from_json(cls, data):
+        """ Build a peer from a decoded tracker API response
+
+        :param data: Peer as returned by the /torrent/{info_hash}/peers endpoint
+        :type data: dict
+        :rtype: Peer
+        """
+        get = data.get
+        return cls(data['peer_id'], get('ip'), get('port'), get('uploaded', 0),
+                   get('downloaded', 0), get('left', 0), get('user_id'))
+
+
+class TorrentCounts(Record):
+    __slots__ = ('torrent_id', 'info_hash', 'seeders', 'leechers', 'snatches')
+
+    def __init__(self, torrent_id, info_hash, seeders=0, leechers=0, snatches=0):
+        self.torrent_id = torrent_id
+        self.info_hash = info_hash
+        self.seeders = seeders
+        self.leechers = leechers
+        self.snatches = snatches
+
+    @classmethod
+    def from_json(cls, data):
+        """ Build a counts record from a decoded /counts entry
+
+        :param data: Single entry of the /counts endpoint
+        :type data: dict
+        :rtype: TorrentCounts
+        """
+        return cls(data['torrent_id'], data['info_hash'], data['seeders'], data['leechers'],
+                   data['snatches'])
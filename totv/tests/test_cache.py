@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+
+"""
+from __future__ import unicode_literals, absolute_import
+import threading
+import time
+from unittest import TestCase
+from totv.cache import LRUCache, MISSING, ResponseCache, SingleFlight
+
+
+class LRUCacheTest(TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(10)
+        self.assertIs(MISSING, cache.get("a"))
+        self.assertIsNone(cache.get("a", None))
+        cache.set("a", None)
+        self.assertIsNone(cache.get("a"))
+        self.assertIn("a", cache)
+        cache.delete("a")
+        self.assertNotIn("a", cache)
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.get("a"))
+        self.assertIs(MISSING, cache.get("b"))
+
+    def test_ttl(self):
+        cache = LRUCache(10, ttl=0.01)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=60)
+        time.sleep(0.02)
+        self.assertIs(MISSING, cache.get("a"))
+        self.assertEqual(2, cache.get("b"))
+
+    def test_replace_keeps_expiry(self):
+        cache = LRUCache(10, ttl=0.05)
+        self.assertFalse(cache.replace("a", 1))
+        cache.set("a", 1)
+        for i in range(5):
+            time.sleep(0.02)
+            cache.replace("a", i)
+        self.assertIs(MISSING, cache.get("a"))
+
+
+class SingleFlightTest(TestCase):
+
+    def test_coalesce(self):
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            release.wait(1)
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", fetch)))
+                   for _ in range(10)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(calls))
+        self.assertEqual(["result"] * 10, results)
+
+    def test_error(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("k", lambda: int("x"))
+        self.assertEqual(1, flight.do("k", lambda: 1))
+
+
+class ResponseCacheTest(TestCase):
+
+    def test_get_or_fetch(self):
+        cache = ResponseCache(ttls={'version': 60})
+        fetch = lambda: {'version': 1}
+        self.assertEqual({'version': 1}, cache.get_or_fetch("version", "version", fetch))
+        self.assertEqual({'version': 1}, cache.get_or_fetch("version", "version", lambda: None))
+        self.assertEqual(1, cache.stats['version'].hits)
+        self.assertEqual(1, cache.stats['version'].misses)
+        cache.invalidate("version")
+        self.assertIsNone(cache.get_or_fetch("version", "version", lambda: None))
+
+    def test_uncached_endpoint(self):
+        cache = ResponseCache(ttls={})
+        self.assertEqual(1, cache.get_or_fetch("uptime", "uptime", lambda: 1))
+        self.assertEqual(2, cache.get_or_fetch("uptime", "uptime", lambda: 2))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+
+"""
+from __future__ import unicode_literals, absolute_import
+from os.path import join
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+import json
+from totv.counts import ADDED, CHANGED, REMOVED, CountsSnapshot, CountsSync
+from totv.records import TorrentCounts
+from totv.tracker import Client
+
+
+def make_counts(n, offset=0):
+    return [{
+        'torrent_id': i,
+        'info_hash': "{:040x}".format(i << 8),
+        'seeders': i % 5,
+        'leechers': i % 3,
+        'snatches': i
+    } for i in range(offset, n + offset)]
+
+
+class CountsSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.counts = make_counts(100)
+        self.snap = CountsSnapshot.from_counts(self.counts)
+
+    def test_round_trip(self):
+        self.assertEqual(100, len(self.snap))
+        self.assertEqual(self.counts, self.snap.to_counts())
+        self.assertEqual(0, len(CountsSnapshot.from_counts([])))
+
+    def test_from_iter(self):
+        self.assertEqual(self.counts, CountsSnapshot.from_iter(iter(self.counts)).to_counts())
+        records = [TorrentCounts.from_json(c) for c in self.counts]
+        self.assertEqual(self.counts, CountsSnapshot.from_iter(records).to_counts())
+        self.assertEqual(0, len(CountsSnapshot.from_iter(iter([]))))
+
+    def test_client_snapshot(self):
+        client = Client("")
+        data = json.dumps(self.counts).encode()
+        resp = mock.Mock()
+        resp.iter_content = lambda size: (data[i:i + size] for i in range(0, len(data), size))
+        client._request = mock.Mock(return_value=resp)
+        snap = client.get_torrent_counts_snapshot()
+        self.assertEqual(self.counts, snap.to_counts())
+        client._request.assert_called_once_with("/counts", stream=True)
+
+    def test_totals(self):
+        totals = self.snap.totals()
+        self.assertEqual(100, totals['torrents'])
+        self.assertEqual(sum(c['seeders'] for c in self.counts), totals['seeders'])
+        self.assertEqual(sum(c['snatches'] for c in self.counts), totals['snatches'])
+
+    def test_top(self):
+        top = self.snap.top(3, by="snatches")
+        self.assertEqual([99, 98, 97], [row.torrent_id for row in top])
+        self.assertEqual(100, len(self.snap.top(1000)))
+        with self.assertRaises(ValueError):
+            self.snap.top(3, by="unknown")
+
+    def test_dead(self):
+        dead = self.snap.dead()
+        self.assertEqual(20, len(dead))
+        self.assertTrue(all(row.seeders == 0 for row in dead))
+
+    def test_diff(self):
+        newer = make_counts(100, offset=10)
+        newer[0]['seeders'] += 7
+        diff = self.snap.diff(CountsSnapshot.from_counts(newer))
+        self.assertEqual(list(range(100, 110)), [r.torrent_id for r in diff.added])
+        self.assertEqual(list(range(0, 10)), [r.torrent_id for r in diff.removed])
+        self.assertEqual([10], [r.torrent_id for r in diff.changed])
+        self.assertEqual([7], list(diff.seeders))
+        self.assertFalse(self.snap.diff(self.snap))
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.counts = []
+
+    def get_torrent_counts_snapshot(self):
+        return CountsSnapshot.from_counts(self.counts)
+
+
+class CountsSyncTest(TestCase):
+
+    def test_poll(self):
+        client = FakeClient()
+        client.counts = make_counts(10)
+        sync = CountsSync(client)
+        first = list(sync.poll())
+        self.assertEqual(10, len(first))
+        self.assertTrue(all(change == ADDED for change, _ in first))
+        self.assertFalse(sync.poll())
+
+        client.counts = make_counts(10, offset=1)
+        client.counts[0]['leechers'] += 1
+        changes = [(change, row.torrent_id) for change, row in sync.poll()]
+        self.assertEqual([(ADDED, 10), (CHANGED, 1), (REMOVED, 0)], changes)
+
+    def test_state_path(self):
+        client = FakeClient()
+        client.counts = make_counts(5)
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, "counts.npz")
+            self.assertEqual(5, len(CountsSync(client, state_path=path).poll()))
+            self.assertFalse(CountsSync(client, state_path=path).poll())
+            # Paths without the .npz extension are used as given
+            path = join(tmp, "counts.state")
+            self.assertEqual(5, len(CountsSync(client, state_path=path).poll()))
+            self.assertFalse(CountsSync(client, state_path=path).poll())
+            self.assertEqual(["counts.npz", "counts.state"], sorted(os.listdir(tmp)))
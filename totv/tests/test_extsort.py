@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+
+"""
+from __future__ import unicode_literals, absolute_import
+import random
+from unittest import TestCase
+from totv.extsort import external_sort
+
+
+class ExternalSortTest(TestCase):
+
+    def setUp(self):
+        self.items = [{'user_id': random.randint(0, 1000), 'n': i} for i in range(1000)]
+
+    def test_in_memory(self):
+        key = lambda u: u['user_id']
+        self.assertEqual(sorted(self.items, key=key), list(external_sort(self.items, key=key)))
+
+    def test_spilled_runs(self):
+        key = lambda u: u['user_id']
+        out = list(external_sort(iter(self.items), key=key, chunk_size=64))
+        self.assertEqual(sorted(self.items, key=key), out)
+
+    def test_reverse(self):
+        values = [random.random() for _ in range(500)]
+        out = list(external_sort(values, reverse=True, chunk_size=50))
+        self.assertEqual(sorted(values, reverse=True), out)
+
+    def test_empty(self):
+        self.assertEqual([], list(external_sort([], chunk_size=10)))
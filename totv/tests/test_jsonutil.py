@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+
+"""
+from __future__ import unicode_literals, absolute_import
+import json
+from unittest import TestCase
+from totv import jsonutil
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class JSONUtilTest(TestCase):
+
+    def setUp(self):
+        self.rows = [{'torrent_id': i, 'info_hash': "{:040x}".format(i), 'seeders': i * 10,
+                      'name': "tést {}".format(i)} for i in range(50)]
+
+    def test_loads(self):
+        data = json.dumps(self.rows)
+        self.assertEqual(self.rows, jsonutil.loads(data))
+        self.assertEqual(self.rows, jsonutil.loads(data.encode()))
+
+    def test_iter_array(self):
+        data = json.dumps(self.rows, indent=1).encode()
+        for size in (1, 7, 4096):
+            self.assertEqual(self.rows, list(jsonutil.iter_array(split(data, size))))
+
+    def test_iter_array_scalars(self):
+        data = b"[1234, 5.5e3, \"a,]\", null, [1, [2]], true]"
+        self.assertEqual([1234, 5.5e3, "a,]", None, [1, [2]], True],
+                         list(jsonutil.iter_array(split(data, 2))))
+        self.assertEqual([], list(jsonutil.iter_array([b" [ ] "])))
+        # Numbers split at every offset, a prefix such as "5." or "1e" is a valid number
+        data = b"[5.5, 1e3,-1500.0 ,12 ]"
+        for i in range(1, len(data)):
+            self.assertEqual([5.5, 1e3, -1500.0, 12],
+                             list(jsonutil.iter_array([data[:i], data[i:]])), data[:i])
+
+    def test_iter_array_invalid(self):
+        with self.assertRaises(ValueError):
+            list(jsonutil.iter_array([b'{"a": 1}']))
+        with self.assertRaises(ValueError):
+            list(jsonutil.iter_array([b'[{"a": 1}, {"b"']))
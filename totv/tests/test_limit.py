@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import asyncio
+import unittest
+from totv.limit import KeyedRateLimit
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class KeyedRateLimitTest(unittest.TestCase):
+    def test_keys(self):
+        clock = _Clock()
+        rejected = []
+        limiter = KeyedRateLimit(rate=2, window=10, key=lambda user: user, clock=clock,
+                                 on_reject=lambda user: rejected.append(user) or "limited")
+
+        @limiter
+        def command(user):
+            return "ok"
+
+        self.assertEqual(["ok", "ok", "limited"], [command("a") for _ in range(3)])
+        self.assertEqual("ok", command("b"))
+        self.assertEqual(["a"], rejected)
+        clock.now = 5
+        self.assertEqual("ok", command("a"))
+        self.assertEqual("limited", command("a"))
+        self.assertIs(limiter, command.limiter)
+        limiter.reset("a")
+        self.assertEqual("ok", command("a"))
+
+    def test_eviction(self):
+        limiter = KeyedRateLimit(rate=1, window=60, max_keys=2)
+        self.assertTrue(limiter.is_allowed("a"))
+        self.assertTrue(limiter.is_allowed("b"))
+        self.assertFalse(limiter.is_allowed("a"))
+        self.assertTrue(limiter.is_allowed("c"))
+        # b was the least recently used key
+        self.assertEqual(2, len(limiter))
+        self.assertTrue(limiter.is_allowed("b"))
+        self.assertFalse(limiter.is_allowed("c"))
+
+    def test_async(self):
+        async def reject(user):
+            return "limited"
+
+        @KeyedRateLimit(rate=1, window=60, key=lambda user: user, on_reject=reject)
+        async def command(user):
+            return "ok"
+
+        async def run():
+            return [await command("a"), await command("a"), await command("b")]
+        self.assertEqual(["ok", "limited", "ok"], asyncio.run(run()))
+
+
+if __name__ == '__main__':
+    unittest.main()
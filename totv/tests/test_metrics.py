@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import unittest
+from totv import metrics
+
+
+class _ListSink(metrics.MetricsSink):
+    def __init__(self):
+        self.observed = []
+
+    def observe(self, endpoint, elapsed, nbytes, error=None):
+        self.observed.append((endpoint, elapsed, nbytes, error))
+
+
+class MetricsTest(unittest.TestCase):
+    def test_endpoint_name(self):
+        self.assertEqual("GET /torrent/{id}/peers", metrics.endpoint_name("get", "/torrent/abc/peers"))
+        self.assertEqual("DELETE /user/{id}", metrics.endpoint_name("delete", "/user/10"))
+        self.assertEqual("GET /counts", metrics.endpoint_name("get", "/counts"))
+
+    def test_histogram(self):
+        hist = metrics.Histogram()
+        self.assertEqual(0.0, hist.quantile(0.5))
+        for i in range(1, 101):
+            hist.observe(i / 1000.0)
+        self.assertEqual(100, hist.count)
+        self.assertAlmostEqual(0.0505, hist.mean)
+        self.assertAlmostEqual(0.05, hist.quantile(0.5), delta=0.01)
+        self.assertAlmostEqual(0.099, hist.quantile(0.99), delta=0.01)
+        self.assertEqual(0.1, hist.quantile(1))
+        hist.observe(60)
+        self.assertEqual(1, hist.counts[-1])
+        self.assertEqual(60, hist.quantile(1))
+
+    def test_record(self):
+        sink = _ListSink()
+        m = metrics.Metrics(sinks=[sink])
+        m.record("GET /version", 0.01, 32)
+        m.record("GET /version", 0.02, 0, "NotFoundError")
+        stats = m.snapshot()["GET /version"]
+        self.assertEqual(2, stats['calls'])
+        self.assertEqual({"NotFoundError": 1}, stats['errors'])
+        self.assertEqual(32, stats['bytes_received'])
+        self.assertEqual(2, len(sink.observed))
+        text = m.prometheus()
+        self.assertIn('totv_tracker_requests_total{endpoint="GET /version"} 2', text)
+        self.assertIn('totv_tracker_request_seconds_bucket{endpoint="GET /version",le="+Inf"} 2',
+                      text)
+        m.reset()
+        self.assertEqual({}, m.snapshot())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import time
+import unittest
+from totv.output import OutputQueue, TokenBucket
+from totv.theme import NORMAL
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_consume(self):
+        clock = _Clock()
+        bucket = TokenBucket(rate=2, burst=2, clock=clock)
+        self.assertEqual(0, bucket.consume())
+        self.assertEqual(0, bucket.consume())
+        self.assertAlmostEqual(0.5, bucket.consume())
+        clock.now = 10
+        self.assertEqual(0, bucket.consume())
+        self.assertEqual(1, bucket.tokens)
+
+
+class OutputQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def send(self, target, line):
+        self.sent.append((target, line))
+
+    def test_merge(self):
+        queue = OutputQueue(self.send, rate=1000, burst=10, merge_sep=" | ")
+        queue.put("#a", "one")
+        queue.put("#a", "two")
+        queue.put("#b", "three")
+        self.assertEqual(3, len(queue))
+        queue.flush()
+        self.assertEqual([("#a", "one" + NORMAL + " | two"), ("#b", "three")], self.sent)
+        self.assertEqual(0, len(queue))
+
+    def test_split_round_robin(self):
+        queue = OutputQueue(self.send, rate=1000, burst=10, max_bytes=40)
+        queue.put("#a", "word " * 20)
+        queue.put("#b", "hi")
+        queue.flush()
+        self.assertEqual(["#a", "#b", "#a", "#a"], [target for target, _ in self.sent])
+        self.assertTrue(all(len(line.encode()) <= 40 for _, line in self.sent))
+
+    def test_rate_limit(self):
+        queue = OutputQueue(self.send, rate=1000, burst=1, merge=False)
+        queue.put("#a", "one")
+        queue.put("#a", "two")
+        self.assertTrue(queue.send_next(block=False))
+        self.assertFalse(queue.send_next(block=False))
+        self.assertEqual(1, len(queue))
+
+    def test_max_queue(self):
+        queue = OutputQueue(self.send, max_queue=2, merge=False)
+        for i in range(4):
+            queue.put("#a", str(i))
+        self.assertEqual(2, queue.dropped)
+        queue.flush()
+        self.assertEqual(["2", "3"], [line for _, line in self.sent])
+
+    def test_thread(self):
+        queue = OutputQueue(self.send, rate=1000, burst=10)
+        queue.start()
+        queue.put("#a", "one")
+        for _ in range(100):
+            if self.sent:
+                break
+            time.sleep(0.01)
+        queue.stop(flush=True)
+        self.assertEqual([("#a", "one")], self.sent)
+
+    def test_stop_while_rate_limited(self):
+        queue = OutputQueue(self.send, rate=1, burst=1, merge=False)
+        queue.put("#a", "one")
+        queue.put("#a", "two")
+        queue.start()
+        for _ in range(100):
+            if self.sent:
+                break
+            time.sleep(0.01)
+        # The thread is now waiting a second for the next token
+        start = time.monotonic()
+        queue.stop()
+        self.assertLess(time.monotonic() - start, 0.5)
+        time.sleep(0.1)
+        self.assertEqual([("#a", "one")], self.sent)
+        self.assertEqual(1, len(queue))
+
+    def test_thread_send_error(self):
+        def send(target, line):
+            if line == "bad":
+                raise IOError("disconnected")
+            self.send(target, line)
+        queue = OutputQueue(send, rate=1000, burst=10, merge=False)
+        with self.assertLogs("totv.output", "ERROR") as logs:
+            queue.start()
+            queue.put("#a", "bad")
+            queue.put("#a", "good")
+            for _ in range(100):
+                if self.sent:
+                    break
+                time.sleep(0.01)
+            queue.stop()
+        self.assertEqual([("#a", "good")], self.sent)
+        self.assertIn("disconnected", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
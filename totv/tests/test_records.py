@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+
+"""
+from __future__ import unicode_literals, absolute_import
+import pickle
+from unittest import TestCase
+from totv.records import Peer, Torrent, TorrentCounts, User
+
+
+class RecordsTest(TestCase):
+
+    def test_user_from_redis(self):
+        user = User.from_redis({b'user_id': b'94', b'username': b'test', b'passkey': b'abc',
+                                b'uploaded': b'100', b'downloaded': b'50', b'enabled': b'1'})
+        self.assertEqual(User(94, "test", "abc", 100, 50, True, True), user)
+        missing = User.from_redis({})
+        self.assertEqual(-1, missing.user_id)
+        self.assertEqual("ERROR: NO USER!", missing.username)
+        self.assertFalse(missing.enabled)
+
+    def test_user_from_json(self):
+        user = User.from_json({'user_id': 94, 'username': 'test', 'passkey': 'abc',
+                               'uploaded': 100, 'downloaded': 50, 'enabled': True,
+                               'can_leech': False})
+        self.assertEqual(100, user.uploaded)
+        self.assertFalse(user.can_leech)
+        self.assertEqual('test', user.to_dict()['username'])
+
+    def test_torrent_from_redis(self):
+        ih = "9c2f8f7f4996b2853509247504681dbe98e5d0c1"
+        tor = Torrent.from_redis({b'torrent_id': b'1112', b'seeders': b'3', b'leechers': b'1'},
+                                 info_hash=ih)
+        self.assertEqual(ih, tor.info_hash)
+        self.assertEqual(1112, tor.torrent_id)
+        self.assertEqual(3, tor.seeders)
+        self.assertEqual(0, tor.snatches)
+
+    def test_peer_and_counts_from_json(self):
+        peer = Peer.from_json({'peer_id': '-DE13B0-abc', 'ip': '12.34.56.78', 'port': 12345})
+        self.assertEqual(12345, peer.port)
+        self.assertIsNone(peer.user_id)
+        counts = TorrentCounts.from_json({'torrent_id': 1112, 'seeders': 1, 'leechers': 2,
+                                          'snatches': 3, 'info_hash': 'abc'})
+        self.assertEqual(TorrentCounts(1112, 'abc', 1, 2, 3), counts)
+
+    def test_slots(self):
+        user = User(1, "test", "abc")
+        with self.assertRaises(AttributeError):
+            user.unknown = 1
+        self.assertEqual(user, pickle.loads(pickle.dumps(user)))
@@ -4,6 +4,7 @@
 """
 from __future__ import unicode_literals, absolute_import
 from unittest import TestCase
+import random
 from totv.theme import *
 
 
@@ -85,3 +86,87 @@ class ThemeTest(TestCase):
         self.assertEqual(b'\x0304Test Title\x0f | \x0303Key\x0f: \x0307Value\x0f | '
                          b'[ \x0303A\x0f: \x0307AValue\x0f / \x0303B\x0f: \x0307BVa'
                          b'lue\x0f / \x0303C\x0f ]', out)
+
+    def test_template(self):
+        template = Template("Test {Title}", ["Key", ("A", "B", "C")])
+        for values in (["Value", "AValue", "B{}Value", "CValue"], ["Value", "AValue", 0, None]):
+            expected = render(
+                title="Test {Title}",
+                items=[
+                    Entity("Key", values[0]),
+                    EntityGroup([Entity("A", values[1]), Entity("B", values[2]),
+                                 Entity("C", values[3])])
+                ]
+            )
+            self.assertEqual(expected, template.render(values))
+        with self.assertRaises(ValueError):
+            template.render(["Value"])
+
+    def test_template_load_theme(self):
+        template = Template("Title", ["Key"])
+        self.assertEqual("\x0304Title\x0f | \x0303Key\x0f: \x0307Value\x0f", template.render(["Value"]))
+        theme = TestTheme()
+        theme.title = YELLOW
+        theme.sep_char = " :: "
+        load_theme(theme)
+        self.assertEqual("\x0308Title\x0f :: \x0303Key\x0f: \x0307Value\x0f", template.render(["Value"]))
+
+    def test_colourize_prefixes(self):
+        self.assertEqual("\x0fhi\x0f", colourize(message="hi"))
+        self.assertEqual("\x0fhi\x0f", colourize(fg=WHITE, message="hi"))
+        self.assertEqual("\x0300,02hi", colourize(fg=WHITE, bg=BLUE, message="hi", auto_end=False))
+        self.assertEqual("\x0304hi\x0f", colourize(fg=RED_LT, bg=WHITE, message="hi"))
+        self.assertEqual("\x0399,99hi\x0f", colourize(fg=TRANS, bg=TRANS, message="hi"))
+        self.assertEqual("\x03100hi\x0f", colourize(fg=100, message="hi"))
+
+    def test_load_theme_constants(self):
+        theme = TestTheme()
+        theme.key = PINK
+        theme.wrap_chars_start = "<"
+        theme.wrap_chars_end = ">"
+        load_theme(theme)
+        self.assertEqual("\x0313a\x0f: \x0307b\x0f", Entity("a", "b").render())
+        self.assertEqual("< x >", wrap("x"))
+
+    def test_render_many(self):
+        expected = [
+            render("Title", [Entity("Key", "Value"), EntityGroup([Entity("A", 1), Entity("B")])]),
+            render(None, [Entity("Key", "Value")])
+        ]
+        self.assertEqual(expected, render_many([
+            ("Title", [("Key", "Value"), [("A", 1), ("B", None)]]),
+            (None, [Entity("Key", "Value")])
+        ]))
+        lines = render_many([("Title", [("Key", "word " * 200)])], max_bytes=100)
+        self.assertGreater(len(lines), 1)
+        self.assertTrue(all(len(line.encode()) <= 100 for line in lines))
+
+    def test_split_message(self):
+        self.assertEqual(["short"], split_message("short"))
+        lines = split_message("\x02\x0304,01" + "ab " * 30, max_bytes=40)
+        self.assertTrue(all(len(line.encode()) <= 40 for line in lines))
+        self.assertEqual("\x02\x0304,01ab", lines[0][:9])
+        for line in lines[1:]:
+            self.assertTrue(line.startswith("\x02\x0304,01ab"))
+        # Never split a multi byte character
+        lines = split_message("日本語" * 40, max_bytes=32)
+        self.assertEqual("日本語" * 40, "".join(lines))
+        self.assertTrue(all(len(line.encode()) <= 32 for line in lines))
+        # A comma after a restored colour must not become a background colour
+        lines = split_message("\x0304" + "a" * 40 + ",1", max_bytes=43)
+        self.assertEqual("\x0304\x02\x02,1", lines[1])
+        # The restored colour and comma guard must not push the moved text over the limit
+        lines = split_message("\x0304 ," + "b" * 45, max_bytes=40)
+        self.assertTrue(all(len(line.encode()) <= 40 for line in lines))
+        self.assertEqual("," + "b" * 45, "".join(lines).replace("\x0304", "").lstrip())
+
+    def test_split_message_random(self):
+        rand = random.Random(42)
+        parts = ["a", "b" * 20, "日", " ", ",", "1", BOLD_CODE, ITALIC, NORMAL, "\x0304",
+                 "\x0304,01", "\x0312,", COLOUR_CODE]
+        for _ in range(500):
+            message = "".join(rand.choice(parts) for _ in range(rand.randint(1, 120)))
+            max_bytes = rand.randint(32, 64)
+            lines = split_message(message, max_bytes=max_bytes)
+            for line in lines:
+                self.assertLessEqual(len(line.encode()), max_bytes, repr(message))
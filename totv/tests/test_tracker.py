@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from string import ascii_lowercase, digits
+from threading import Lock, Thread
+import json
+import os
 import unittest
+from unittest import mock
 import logging
 import http.client as httplib
 import random
+import time
+import warnings
 from urllib.parse import quote_plus
 import bencodepy
+import numpy as np
 import binascii
 import requests
+import asyncio
 from totv import tracker
+from totv import aiotracker
 from totv import exc
 
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
 logging.captureWarnings(True)
 
 
@@ -273,6 +289,16 @@ class ClientTest(_TrackerTestBase):
         with self.assertRaises(exc.NotFoundError):
             self.client.torrent_get(rand_info_hash())
 
+    def test_torrent_get_all(self):
+        tors = [self._load_test_torrent() for _ in range(4)]
+        missing = [rand_info_hash() for _ in range(2)]
+        info_hashes = [tors[0].info_hash, missing[0], tors[1].info_hash, tors[2].info_hash,
+                       missing[1], tors[3].info_hash]
+        for concurrency in (1, 4):
+            found, not_found = self.client.torrent_get_all(info_hashes, concurrency=concurrency)
+            self.assertEqual([t.torrent_id for t in tors], [t['torrent_id'] for t in found])
+            self.assertEqual(missing, not_found)
+
     def test_torrent_counts(self):
         tor = self._load_test_torrent()
         counts = self.client.get_torrent_counts()
@@ -294,6 +320,25 @@ class ClientTest(_TrackerTestBase):
         self.assertEqual(httplib.ACCEPTED, resp2.status_code)
         self._added.append(info_hash)
 
+    def test_torrent_add_many(self):
+        torrents = [(rand_info_hash(), random.randint(999999, 99999999), self._rand_torrent_name())
+                    for _ in range(5)]
+        self._added.extend(t[0] for t in torrents)
+        bad = ("invalid", 1, self._rand_torrent_name())
+        resp = self.client.torrent_add_many(torrents + [bad], chunk_size=2, concurrency=2)
+        self.assertEqual(torrents, resp.ok)
+        self.assertEqual([bad], [item for item, _ in resp.invalid])
+        self.assertEqual([], resp.failed)
+
+    def test_user_add_many(self):
+        users = [("test_user_{}".format(rand_info_hash(5)), random.randint(1000000, 1000000000),
+                  rand_info_hash(22)) for _ in range(3)]
+        self._users.extend(u[1] for u in users)
+        resp = self.client.user_add_many(users)
+        self.assertEqual(users, resp.ok)
+        resp = self.client.user_add_many(users[:1])
+        self.assertEqual(users[:1], resp.duplicate)
+
     def test_torrent_del(self):
         tor = self._load_test_torrent()
         resp = self.client.torrent_del(tor.info_hash)
@@ -317,6 +362,17 @@ class ClientTest(_TrackerTestBase):
         self.assertEqual(user['downloaded'], a)
         self.assertEqual(user['uploaded'], a*2)
 
+    def test_user_update_cached(self):
+        client = tracker.Client("https://{}:34001/api".format(self._ip), user_cache_size=10)
+        user = self._load_test_user()
+        client.user_get(user.user_id)
+        self.assertTrue(client.user_update(user.user_id, uploaded=100))
+        self.assertTrue(client.user_update(user.user_id, downloaded=50, partial=True))
+        cached = client.user_get(user.user_id)
+        self.assertEqual(cached, client.user_get(user.user_id, use_cache=False))
+        self.assertEqual(100, cached['uploaded'])
+        self.assertEqual(50, cached['downloaded'])
+
     def test_user_add(self):
         user_name = "test_user_{}".format(rand_info_hash(5))
         user_id = random.randint(1000000, 1000000000)
@@ -355,5 +411,680 @@ class ClientTest(_TrackerTestBase):
         self.assertGreater(resp['system'], 0)
         self.assertGreater(resp['system'], resp['process'])
 
+
+class AsyncClientTest(_TrackerTestBase):
+    """
+    Tests for the asyncio flavour of the client library.
+    """
+    def setUp(self):
+        super(AsyncClientTest, self).setUp()
+        self.async_client = aiotracker.AsyncClient("https://{}:34001/api".format(self._ip))
+
+    def tearDown(self):
+        asyncio.run(self.async_client.close())
+        super(AsyncClientTest, self).tearDown()
+
+    def test_torrent_get(self):
+        tor = self._load_test_torrent()
+
+        async def run():
+            t1 = await self.async_client.torrent_get(tor.info_hash)
+            self.assertEqual(t1['torrent_id'], tor.torrent_id)
+            with self.assertRaises(exc.NotFoundError):
+                await self.async_client.torrent_get(rand_info_hash())
+            found, not_found = await self.async_client.torrent_get_all(
+                [tor.info_hash, rand_info_hash()], concurrency=2)
+            self.assertEqual([tor.torrent_id], [t['torrent_id'] for t in found])
+            self.assertEqual(1, len(not_found))
+        asyncio.run(run())
+
+    def test_version(self):
+        resp = asyncio.run(self.async_client.version())
+        self.assertIn("name", resp)
+        self.assertIn("version", resp)
+
+
+class InfoHashTest(unittest.TestCase):
+    def test_info_hash(self):
+        hex_ih = rand_info_hash()
+        ih = tracker.InfoHash(hex_ih)
+        self.assertEqual(hex2bin(hex_ih), ih)
+        self.assertEqual(hex_ih, str(ih))
+        self.assertIs(ih, tracker.InfoHash(ih))
+        self.assertEqual(ih, tracker.InfoHash(hex2bin(hex_ih)))
+        self.assertEqual(hex_ih, tracker.validate_info_hash(ih))
+        for bad in ["", "z" * 40, hex_ih[:-2], b"x" * 19, 1]:
+            with self.assertRaises(exc.ValidationError):
+                tracker.InfoHash(bad)
+
+    def test_validate_info_hashes(self):
+        hashes = [rand_info_hash() for _ in range(5)]
+        self.assertEqual(hashes, [str(ih) for ih in tracker.validate_info_hashes(hashes)])
+        self.assertEqual([], tracker.validate_info_hashes([]))
+        with self.assertRaises(exc.ValidationError):
+            tracker.validate_info_hashes(hashes + ["z" * 40])
+
+    def test_validate_info_hashes_array(self):
+        raw = [hex2bin(rand_info_hash()) for _ in range(5)] + [b"x" * 19 + b"\0", b"\0" * 20]
+        for dtype in ("S20", "V20"):
+            self.assertEqual(raw, tracker.validate_info_hashes(np.array(raw, dtype=dtype)))
+        hashes = [ih.hex() for ih in raw]
+        self.assertEqual(raw, tracker.validate_info_hashes(np.array(hashes)))
+
+    def test_torrent_get_all_info_hash(self):
+        info_hashes = [tracker.InfoHash(rand_info_hash()) for _ in range(3)]
+        torrent = {"info_hash": str(info_hashes[0]), "name": "x"}
+
+        async def torrent_get(info_hash):
+            return torrent
+        client = tracker.Client("")
+        client.torrent_get = lambda info_hash: torrent
+        async_client = aiotracker.AsyncClient("")
+        async_client.torrent_get = torrent_get
+        found, _ = client.torrent_get_all(info_hashes)
+        self.assertEqual(info_hashes, [t["info_hash"] for t in found])
+        self.assertIs(tracker.InfoHash, type(found[0]["info_hash"]))
+        self.assertEqual((found, []), asyncio.run(async_client.torrent_get_all(info_hashes)))
+        # The shared response is never modified
+        self.assertEqual(str(info_hashes[0]), torrent["info_hash"])
+
+
+class CleanupReportTest(unittest.TestCase):
+    def test_report(self):
+        report = tracker.CleanupReport(sample_size=2, cursors={"t:u:*": 10, "t:t:*": None})
+        for key in [b"t:u:1", b"t:u:1", b"t:u:2", b"t:u:3"]:
+            report.add(tracker.MISSING_FIELD, key)
+        report.count(scanned=4)
+        self.assertFalse(report.complete)
+        data = report.to_dict()
+        self.assertEqual({tracker.MISSING_FIELD: 4}, data['problems'])
+        self.assertEqual({tracker.MISSING_FIELD: ["t:u:1", "t:u:2"]}, data['samples'])
+        self.assertEqual(4, data['scanned'])
+
+    def test_validate_int_fields(self):
+        data = {b'uploaded': b"1", b'downloaded': b"-1", b'snatches': b"x",
+                b'announces': str(2 ** 63).encode()}
+        self.assertEqual({
+            b'downloaded': tracker.NEGATIVE_INT,
+            b'snatches': tracker.INVALID_INT,
+            b'announces': tracker.INT_OVERFLOW,
+            b'corrupt': tracker.MISSING_FIELD
+        }, tracker.Client("")._validate_int_fields(b"t:u:1", data, tracker.USER_INT_FIELDS))
+
+
+class RedisPoolTest(unittest.TestCase):
+    def tearDown(self):
+        tracker.close_redis_pools()
+
+    def test_shared_pool(self):
+        c1 = tracker.Client("", share_redis_pool=True, redis_max_connections=5)
+        c2 = tracker.Client("", share_redis_pool=True)
+        c3 = tracker.Client("", share_redis_pool=True, redis_db=1)
+        self.assertIs(c1._redis.connection_pool, c2._redis.connection_pool)
+        self.assertIsNot(c1._redis.connection_pool, c3._redis.connection_pool)
+        self.assertEqual(5, c2._redis.connection_pool.max_connections)
+        self.assertIsNot(c1._redis.connection_pool,
+                         tracker.Client("")._redis.connection_pool)
+
+    def test_pool_options(self):
+        pool = tracker.make_redis_pool(url="redis://example:6380/2", health_check_interval=30)
+        self.assertEqual(("example", 6380, 2, 30), tuple(pool.connection_kwargs[k] for k in (
+            "host", "port", "db", "health_check_interval")))
+        pool = tracker.make_redis_pool(unix_socket_path="/tmp/redis.sock", db=3)
+        self.assertEqual("/tmp/redis.sock", pool.connection_kwargs["path"])
+        self.assertEqual(3, pool.connection_kwargs["db"])
+
+
+def populate_redis(r, n=10):
+    for i in range(1, n + 1):
+        r.hset("t:u:{}".format(i), mapping={
+            "user_id": i, "username": "user{}".format(i), "passkey": "pk{}".format(i),
+            "uploaded": i * 10, "downloaded": n - i, "snatches": 0, "announces": i,
+            "corrupt": 0, "enabled": 1})
+        r.hset("t:t:{:040x}".format(i), mapping={
+            "torrent_id": i, "seeders": n - i, "leechers": 1, "snatches": 0, "uploaded": 0,
+            "downloaded": 0, "announces": i})
+
+
+class _RedisTestBase(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeStrictRedis(server=self.server)
+        populate_redis(self.redis)
+        # Keys the readers must skip
+        self.redis.set("t:u:999", "not a hash")
+        self.redis.hset("t:t:123", "torrent_id", 123)
+        self.client = tracker.Client("", scan_count=3, batch_size=4)
+        self.client._redis = self.redis
+
+    def async_client(self):
+        client = aiotracker.AsyncClient("", scan_count=3, batch_size=4)
+        client._redis = fakeredis.FakeAsyncRedis(server=self.server)
+        return client
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisScanTest(_RedisTestBase):
+    def test_scan_keys(self):
+        keys = set(self.client._scan_keys("t:u:*"))
+        self.assertEqual({"t:u:{}".format(i).encode() for i in range(1, 11)} | {b"t:u:999"}, keys)
+
+    def test_readers_never_use_keys(self):
+        with mock.patch.object(self.redis, "keys", side_effect=AssertionError("KEYS used")), \
+                mock.patch.object(self.redis, "scan", wraps=self.redis.scan) as scan:
+            users = list(self.client.iter_users_redis())
+            torrents = list(self.client.iter_torrents_redis())
+        self.assertEqual(10, len(users))
+        self.assertEqual(10, len(torrents))
+        self.assertTrue(all(call.kwargs["count"] == 3 for call in scan.call_args_list))
+        # A small COUNT hint walks the keyspace over several cursor pages
+        self.assertGreater(scan.call_count, 2)
+
+    def test_iter_users_redis(self):
+        users = self.client.users_get_all_redis()
+        self.assertEqual(list(range(1, 11)), [u["user_id"] for u in users])
+        self.assertEqual(20, users[1]["uploaded"])
+        users = self.client.users_get_all_redis(sort="user_id", records=True)
+        self.assertEqual(list(range(1, 11)), [u.user_id for u in users])
+
+    def test_iter_torrents_redis(self):
+        torrents = self.client.torrent_get_all_redis()
+        self.assertEqual(set(range(1, 11)), {int(t[b"torrent_id"]) for t in torrents})
+        torrents = self.client.torrent_get_all_redis(records=True)
+        self.assertEqual({"{:040x}".format(i) for i in range(1, 11)},
+                         {t.info_hash for t in torrents})
+
+    def test_sorted_readers(self):
+        users = list(self.client.iter_users_redis(sort="downloaded", sort_chunk_size=3))
+        self.assertEqual(list(range(10, 0, -1)), [u["user_id"] for u in users])
+        torrents = list(self.client.iter_torrents_redis(sort="seeders", sort_chunk_size=3))
+        self.assertEqual(list(range(10, 0, -1)), [int(t[b"torrent_id"]) for t in torrents])
+
+    def test_async_readers(self):
+        client = self.async_client()
+
+        async def read():
+            keys = [key async for key in client._scan_keys("t:t:*")]
+            users = await client.users_get_all_redis()
+            torrents = await client.torrent_get_all_redis()
+            return keys, users, torrents
+
+        keys, users, torrents = asyncio.run(read())
+        self.assertEqual(11, len(keys))
+        self.assertEqual(list(range(1, 11)), [u["user_id"] for u in users])
+        self.assertEqual(set(range(1, 11)), {int(t[b"torrent_id"]) for t in torrents})
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisPipelineTest(_RedisTestBase):
+    keys = [b"t:u:1", b"t:u:999", b"t:u:404", b"t:u:2"] * 2
+
+    def check_results(self, results):
+        self.assertEqual(self.keys, [key for key, _ in results])
+        self.assertEqual(b"user1", results[0][1][b"username"])
+        self.assertIsInstance(results[1][1], tracker.redis.ResponseError)
+        self.assertEqual({}, results[2][1])
+        self.assertEqual(b"user2", results[7][1][b"username"])
+
+    def test_hgetall_batched(self):
+        self.check_results(list(self.client._hgetall_batched(self.keys, batch_size=3)))
+
+    def test_one_pipeline_per_batch(self):
+        with mock.patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as pipeline:
+            users = self.client.users_get_all_redis()
+        # 11 user keys read 4 at a time, the key that is not a hash is skipped
+        self.assertEqual(3, pipeline.call_count)
+        self.assertEqual(list(range(1, 11)), [u["user_id"] for u in users])
+
+    def test_async_hgetall_batched(self):
+        client = self.async_client()
+
+        async def keys():
+            for key in self.keys:
+                yield key
+
+        async def read():
+            return [item async for item in client._hgetall_batched(keys(), batch_size=3)]
+        self.check_results(asyncio.run(read()))
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class CleanupTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+        populate_redis(self.redis, 30)
+        self.redis.hdel("t:u:2", "corrupt")
+        self.redis.hset("t:u:3", "uploaded", -4)
+        self.redis.hset("t:u:4", "snatches", 2 ** 63)
+        self.redis.hset("t:u:5", mapping={"announces": "x", "downloaded": "1.5"})
+        self.redis.set("t:u:6", "not a hash")
+        self.redis.hset("t:u:7:active", "x", 1)
+        self.redis.hset("t:t:{:040x}".format(8), mapping={"seeders": -1, "leechers": "-0"})
+        self.redis.hdel("t:t:{:040x}".format(9), "announces")
+        self.redis.delete("t:t:{:040x}".format(10))
+        self.redis.rpush("t:t:{:040x}".format(10), "x")
+        self.redis.hset("t:t:123", "x", 1)
+
+    def client(self):
+        client = tracker.Client("", scan_count=7, batch_size=4)
+        client._redis = self.redis
+        return client
+
+    def dump(self):
+        return {key: self.redis.dump(key) for key in self.redis.keys()}
+
+    def assert_same_report(self, expected, report):
+        expected, report = expected.to_dict(), report.to_dict()
+        for data in (expected, report):
+            data['samples'] = {k: sorted(v) for k, v in data['samples'].items()}
+        self.assertEqual(expected, report)
+
+    def test_server_side_report(self):
+        client = self.client()
+        before = self.dump()
+        report = client.cleanup()
+        self.assertEqual({
+            tracker.STALE_KEY: 2,
+            tracker.WRONG_TYPE: 2,
+            tracker.MISSING_FIELD: 2,
+            tracker.NEGATIVE_INT: 2,
+            tracker.INT_OVERFLOW: 1,
+            tracker.INVALID_INT: 2
+        }, report.problems)
+        self.assertEqual(["t:u:5"], report.samples[tracker.INVALID_INT])
+        self.assert_same_report(report, client.cleanup(server_side=True))
+        # Without delete nothing is written
+        self.assertEqual(before, self.dump())
+
+    def test_server_side_delete(self):
+        expected = self.client().cleanup(delete=True)
+        fixed = self.dump()
+        self.setUp()
+        report = self.client().cleanup(delete=True, server_side=True)
+        self.assert_same_report(expected, report)
+        self.assertEqual(2, report.deleted)
+        self.assertEqual(6, report.fixed)
+        self.assertEqual(fixed, self.dump())
+        self.assertEqual(b"0", self.redis.hget("t:u:3", "uploaded"))
+        self.assertEqual({tracker.WRONG_TYPE: 2},
+                         self.client().cleanup(server_side=True).problems)
+
+    def test_repair_int_fields(self):
+        client = self.client()
+        keys = [b"t:u:1", b"t:u:3", b"t:u:5", b"t:u:6", b"t:u:404"]
+        self.assertEqual([
+            (b"t:u:3", {b"uploaded": tracker.NEGATIVE_INT}),
+            (b"t:u:5", {b"downloaded": tracker.INVALID_INT, b"announces": tracker.INVALID_INT}),
+            (b"t:u:6", None)
+        ], list(client._repair_int_fields(keys, tracker.USER_INT_FIELDS, batch_size=2)))
+        self.assertEqual(b"-4", self.redis.hget("t:u:3", "uploaded"))
+        list(client._repair_int_fields(keys, tracker.USER_INT_FIELDS, update=True))
+        self.assertEqual(b"0", self.redis.hget("t:u:3", "uploaded"))
+        self.assertEqual([(b"t:u:6", None)],
+                         list(client._repair_int_fields(keys, tracker.USER_INT_FIELDS)))
+
+
+class _BotAPIHandler(BaseHTTPRequestHandler):
+    """ Bot API stub recording the highest number of requests handled at once """
+    protocol_version = "HTTP/1.1"
+    lock = Lock()
+    active = 0
+    max_active = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        cls = self.__class__
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.active -= 1
+        if self.path.endswith("/fail"):
+            return self._send(b"not json")
+        self._send(json.dumps({"path": self.path,
+                               "key": self.headers["X-IRCBOT-API-KEY"]}).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self._send(json.dumps({"path": self.path, "body": body.decode()}).encode())
+
+
+class BotAPIClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _BotAPIHandler)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = "http://127.0.0.1:{}/api/bot".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _BotAPIHandler.max_active = 0
+
+    def tearDown(self):
+        tracker.configure("", "")
+
+    def calls(self):
+        calls = [("/get/{}".format(i),) for i in range(6)]
+        calls.insert(3, ("/fail", "GET"))
+        calls.append({"endpoint": "/post", "method": "POST", "payload": {"a": [1, 2]}})
+        calls.append(("/post", "POST", "raw body"))
+        return calls
+
+    def check_batch(self, results):
+        self.assertEqual(9, len(results))
+        self.assertEqual(["/api/bot/get/{}".format(i) for i in range(6)],
+                         [r["path"] for r in results[:3] + results[4:7]])
+        self.assertIsInstance(results[3], ValueError)
+        self.assertEqual({"a": [1, 2]}, json.loads(results[7]["body"]))
+        self.assertEqual("raw body", results[8]["body"])
+        self.assertEqual(2, _BotAPIHandler.max_active)
+
+    def test_batch(self):
+        with tracker.BotAPIClient(self.base_url, "key", pool_maxsize=4) as client:
+            self.check_batch(client.batch(self.calls(), concurrency=2))
+            self.assertEqual("key", client.request("/get/1")["key"])
+
+    def test_pool_block(self):
+        calls = [("/get/{}".format(i),) for i in range(6)]
+        with tracker.BotAPIClient(self.base_url, "key", pool_maxsize=2,
+                                  pool_block=True) as client:
+            results = client.batch(calls, concurrency=6)
+        self.assertEqual(6, len([r for r in results if isinstance(r, dict)]))
+        self.assertEqual(2, _BotAPIHandler.max_active)
+
+    def test_batch_async(self):
+        async def batch():
+            async with aiotracker.AsyncBotAPIClient(self.base_url, "key",
+                                                    pool_maxsize=4) as client:
+                return await client.batch(self.calls(), concurrency=2)
+        self.check_batch(asyncio.run(batch()))
+
+    def test_configure(self):
+        tracker.configure(self.base_url, "k1")
+        self.assertEqual("k1", tracker.bot_api_request("/get/1")["key"])
+        client = tracker._bot_client
+        self.assertEqual("k1", tracker.bot_api_request("/get/2")["key"])
+        self.assertIs(client, tracker._bot_client)
+        tracker.configure(self.base_url, "k2")
+        self.assertIsNone(tracker._bot_client)
+        self.assertEqual("k2", tracker.bot_api_request("/get/1")["key"])
+        self.assertIsNot(client, tracker._bot_client)
+        self.assertEqual({"a": 1}, json.loads(
+            tracker.bot_api_request("/post", "POST", {"a": 1})["body"]))
+
+
+class _TrackerHandler(BaseHTTPRequestHandler):
+    """ Tracker API stub, lookups of info hashes ending in a higher digit take longer so
+    concurrent requests finish out of order
+    """
+    protocol_version = "HTTP/1.1"
+    lock = Lock()
+    torrents = {}
+    users = {}
+    active = 0
+    max_active = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, obj=None):
+        body = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        cls = self.__class__
+        info_hash = self.path.rsplit("/", 1)[-1]
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        time.sleep(int(info_hash[-1], 16) * 0.005)
+        with cls.lock:
+            cls.active -= 1
+        torrent = cls.torrents.get(info_hash)
+        self._send(404) if torrent is None else self._send(200, torrent)
+
+    def do_POST(self):
+        cls = self.__class__
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.endswith("/torrent"):
+            table, key = cls.torrents, payload["info_hash"]
+        else:
+            table, key = cls.users, payload["user_id"]
+        with cls.lock:
+            if key in table:
+                return self._send(409)
+            table[key] = payload
+        self._send(201)
+
+
+class _StubTrackerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _TrackerHandler)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_uri = "http://127.0.0.1:{}/api".format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _TrackerHandler.torrents.clear()
+        _TrackerHandler.users.clear()
+        _TrackerHandler.max_active = 0
+
+
+class TorrentGetAllStubTest(_StubTrackerTest):
+    def setUp(self):
+        super(TorrentGetAllStubTest, self).setUp()
+        # Earlier lookups are slower, found and unknown hashes alternate
+        self.lookups = ["{:039x}{:x}".format(i, 15 - i) for i in range(12)]
+        self.known = self.lookups[::2]
+        for i, info_hash in enumerate(self.known):
+            _TrackerHandler.torrents[info_hash] = {"info_hash": info_hash, "torrent_id": i}
+
+    def check(self, found, not_found):
+        self.assertEqual(self.known, [t["info_hash"] for t in found])
+        self.assertEqual(self.lookups[1::2], not_found)
+        self.assertGreater(_TrackerHandler.max_active, 1)
+
+    def test_torrent_get_all(self):
+        client = tracker.Client(self.api_uri)
+        self.check(*client.torrent_get_all(self.lookups, concurrency=4))
+
+    def test_torrent_get_all_async(self):
+        async def get_all():
+            async with aiotracker.AsyncClient(self.api_uri) as client:
+                return await client.torrent_get_all(self.lookups, concurrency=4)
+        self.check(*asyncio.run(get_all()))
+
+
+class BulkAddStubTest(_StubTrackerTest):
+    def setUp(self):
+        super(BulkAddStubTest, self).setUp()
+        # Torrent 1 and user 2 already exist
+        _TrackerHandler.torrents["{:040x}".format(1)] = {}
+        _TrackerHandler.users[2] = {}
+        self.torrents = [("{:040x}".format(i), i, "t{}".format(i)) for i in range(1, 7)]
+        self.torrents.insert(3, ("abc", 10, "invalid"))
+        self.users = [{"name": "u{}".format(i), "user_id": i, "passkey": "x" * 32}
+                      for i in range(1, 6)]
+
+    def check(self, torrents, users):
+        self.assertEqual([self.torrents[i] for i in (1, 2, 4, 5, 6)], torrents.ok)
+        self.assertEqual([self.torrents[0]], torrents.duplicate)
+        self.assertEqual([self.torrents[3]], [item for item, _ in torrents.invalid])
+        self.assertIsInstance(torrents.invalid[0][1], exc.ValidationError)
+        self.assertEqual([], torrents.failed)
+        self.assertEqual(7, len(torrents))
+        self.assertEqual([1, 3, 4, 5], [u["user_id"] for u in users.ok])
+        self.assertEqual([self.users[1]], users.duplicate)
+        self.assertEqual({"{:040x}".format(i) for i in range(1, 7)},
+                         set(_TrackerHandler.torrents))
+        self.assertEqual(set(range(1, 6)), set(_TrackerHandler.users))
+
+    def test_add_many(self):
+        client = tracker.Client(self.api_uri)
+        self.check(client.torrent_add_many(self.torrents, chunk_size=3, concurrency=2),
+                   client.user_add_many(self.users, chunk_size=2, concurrency=2))
+
+    def test_add_many_async(self):
+        async def add():
+            async with aiotracker.AsyncClient(self.api_uri) as client:
+                return (await client.torrent_add_many(self.torrents, chunk_size=3,
+                                                      concurrency=2),
+                        await client.user_add_many(self.users, chunk_size=2, concurrency=2))
+        self.check(*asyncio.run(add()))
+
+
+class ClientVerifyTest(unittest.TestCase):
+    def test_verify_with_ca_bundle_env(self):
+        client = tracker.Client("https://127.0.0.1:34001/api", verify=False)
+        sent = []
+
+        def send(request, **kwargs):
+            sent.append(kwargs['verify'])
+            resp = requests.Response()
+            resp.status_code = 200
+            resp._content = b'{"name": "mika"}'
+            resp.request = request
+            return resp
+
+        with mock.patch.dict(os.environ, {"REQUESTS_CA_BUNDLE": "/tmp/ca.pem",
+                                          "CURL_CA_BUNDLE": "/tmp/ca.pem"}), \
+                mock.patch.object(client._session, "send", side_effect=send):
+            client.version()
+            client.whitelist_del("-XX")
+        self.assertEqual([False, False], sent)
+
+
+class AsyncClientSessionTest(unittest.TestCase):
+    def test_auth_header(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            client = aiotracker.AsyncClient("http://127.0.0.1:1/api", "dev", "dev")
+
+            async def headers():
+                return dict(client._get_session().headers)
+            self.assertEqual("Basic ZGV2OmRldg==",
+                             asyncio.run(headers())["Authorization"])
+        self.assertNotIn("Authorization", aiotracker.AsyncClient("", None, None)._headers)
+
+    def test_event_loop(self):
+        client = aiotracker.AsyncClient("http://127.0.0.1:1/api")
+
+        async def session():
+            return client._get_session()
+
+        async def close():
+            await client.close()
+        loop = asyncio.new_event_loop()
+        try:
+            first = loop.run_until_complete(session())
+            self.assertIs(first, loop.run_until_complete(session()))
+            with self.assertRaises(RuntimeError):
+                asyncio.run(session())
+            loop.run_until_complete(close())
+        finally:
+            loop.close()
+        async def reopen():
+            try:
+                return client._get_session()
+            finally:
+                await client.close()
+        # A closed client can be used from another loop
+        self.assertIsNot(first, asyncio.run(reopen()))
+
+
+class CoalesceTest(unittest.TestCase):
+    def test_coalesce_threads(self):
+        for coalesce, calls in ((True, 1), (False, 8)):
+            client = tracker.Client("http://127.0.0.1:1/api", coalesce=coalesce)
+            paths = []
+
+            def request(path, method='get', payload=None, valid_codes=None, stream=False):
+                paths.append(path)
+                time.sleep(0.1)
+                return mock.Mock(content=b'{"name": "mika", "version": "1"}')
+            client._request = request
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(lambda _: client.version(), range(8)))
+            self.assertEqual(calls, len(paths))
+            self.assertEqual(calls, len({id(result) for result in results}))
+            self.assertTrue(all(result["name"] == "mika" for result in results))
+
+    def test_coalesce_tasks(self):
+        async def fetch(client, calls):
+            async def send(path, method='get', payload=None, valid_codes=None):
+                calls.append(path)
+                await asyncio.sleep(0.05)
+                return None, b'{"name": "mika", "version": "1"}'
+            client._send = send
+            tasks = [asyncio.ensure_future(client.version()) for _ in range(5)]
+            await asyncio.sleep(0.01)
+            # Cancelling one caller must not cancel the request shared with the others
+            tasks[0].cancel()
+            return await asyncio.gather(*tasks[1:])
+
+        for coalesce, calls in ((True, 1), (False, 5)):
+            client = aiotracker.AsyncClient("http://127.0.0.1:1/api", coalesce=coalesce)
+            paths = []
+            results = asyncio.run(fetch(client, paths))
+            self.assertEqual(calls, len(paths))
+            self.assertEqual(1 if coalesce else 4, len({id(result) for result in results}))
+            self.assertTrue(all(result["name"] == "mika" for result in results))
+            self.assertEqual({}, client._inflight)
+
+
+class UserCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server_user = {"user_id": 1, "username": "a", "passkey": "x" * 32, "uploaded": 0,
+                            "downloaded": 0, "enabled": True, "can_leech": True}
+        self.payloads = []
+        self.client = tracker.Client("http://127.0.0.1:1/api", user_cache_size=10,
+                                     user_cache_ttl=60)
+
+        def request(path, method='get', payload=None, valid_codes=None, stream=False):
+            self.payloads.append(payload)
+            return mock.Mock(status_code=httplib.ACCEPTED)
+        self.client._request = request
+        self.client._get_json = lambda path, decode=None: dict(self.server_user)
+
+    def test_update_uses_fresh_transfer_stats(self):
+        self.client.user_get(1)
+        for i in range(1, 4):
+            # Stats collected by the tracker from announces
+            self.server_user["downloaded"] = i * 100
+            self.client.user_update(1, enabled=False)
+            self.assertEqual(i * 100, self.payloads[-1]["downloaded"])
+
+    def test_update_keeps_cache_expiry(self):
+        client = self.client
+        client._user_cache = tracker.LRUCache(10, 0.05)
+        client.user_get(1)
+        self.server_user["username"] = "b"
+        for _ in range(5):
+            time.sleep(0.02)
+            client.user_update(1, uploaded=1, downloaded=1)
+        # The cached copy expired during the updates and was fetched again
+        self.assertEqual("b", client.user_get(1)["username"])
+
 if __name__ == '__main__':
     unittest.main()
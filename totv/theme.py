@@ -15,6 +15,7 @@ Basic usage, create a theme based on BaseTheme and load it:
 from __future__ import unicode_literals, absolute_import
 import abc
 import random
+import re
 
 
 # Special chars
@@ -49,6 +50,13 @@ COLOUR_CODE = "\003"
 NORMAL = "\017"
 REVERSE = "\026"
 UNDERLINE = "\037"
+ITALIC = "\035"
+STRIKETHROUGH = "\036"
+MONOSPACE = "\021"
+
+# IRC lines are limited to 512 bytes including the ":nick!user@host PRIVMSG #target :" prefix
+# the server adds when relaying and the trailing CRLF, this leaves room for both
+MAX_MESSAGE_BYTES = 400
 
 
 def colourize(fg: int=None, bg: int=None, message: str="", auto_end: bool=True) -> str:
@@ -65,14 +73,27 @@ def colourize(fg: int=None, bg: int=None, message: str="", auto_end: bool=True)
     :return: Colour coded message
     :rtype: unicode
     """
+    try:
+        code = _prefixes[fg, bg]
+    except (KeyError, TypeError):
+        code = _colour_prefix(fg, bg)
+    return "".join([code, message, NORMAL if auto_end else ""])
+
+
+def _colour_prefix(fg, bg):
     if not fg and not bg:
         # Reset colouring
-        code = NORMAL
+        return NORMAL
     elif fg and not bg:
-        code = "{0}{1:02d}".format(COLOUR_CODE, fg)
+        return "{0}{1:02d}".format(COLOUR_CODE, fg)
     else:
-        code = "{0}{1:02d},{2:02d}".format(COLOUR_CODE, fg, bg)
-    return "".join([code, message, NORMAL if auto_end else ""])
+        return "{0}{1:02d},{2:02d}".format(COLOUR_CODE, fg, bg)
+
+
+# Control code prefix of every valid fg/bg combination, built once instead of on every call
+_colours = (None,) + tuple(range(16)) + (TRANS,)
+_prefixes = {(fg, bg): _colour_prefix(fg, bg) for fg in _colours for bg in _colours
+             if fg is not None or bg is None}
 
 
 class BaseTheme(object):
@@ -114,7 +135,27 @@ class BaseTheme(object):
         ])
 
 
+class _ThemeConstants(object):
+    """ Values derived from the active theme, rebuilt by load_theme so the render functions
+    don't need to colourize the same keys, values and titles on every call
+    """
+
+    __slots__ = ('sep_char', 'group_sep_char', 'value_sep', 'wrap_chars_start',
+                 'wrap_chars_end', 'title_prefix', 'key_prefix', 'value_prefix')
+
+    def __init__(self, theme):
+        self.sep_char = theme.sep_char
+        self.group_sep_char = theme.group_sep_char
+        self.value_sep = theme.value_sep
+        self.wrap_chars_start = theme.wrap_chars_start
+        self.wrap_chars_end = theme.wrap_chars_end
+        self.title_prefix = colourize(fg=theme.title, auto_end=False)
+        self.key_prefix = colourize(fg=theme.key, auto_end=False)
+        self.value_prefix = colourize(fg=theme.value, auto_end=False)
+
+
 _theme = BaseTheme()
+_constants = _ThemeConstants(_theme)
 
 
 def random_colour(min_colour=2, max_colour=15):
@@ -157,14 +198,12 @@ class Entity(Renderable):
         self.value = str(value) if value is not None else ""
 
     def render(self):
+        c = _constants
         if self.value:
-            return "".join([
-                colourize(fg=_theme.key, message=self.key),
-                _theme.value_sep,
-                colourize(fg=_theme.value, message=self.value)
-            ])
+            return "".join([c.key_prefix, self.key, NORMAL, c.value_sep, c.value_prefix,
+                            self.value, NORMAL])
         else:
-            return colourize(fg=_theme.key, message=self.key)
+            return "".join([c.key_prefix, self.key, NORMAL])
 
     def __unicode__(self):
         return self.render()
@@ -175,7 +214,7 @@ class Entity(Renderable):
 
 class EntityGroup(list, Renderable):
     def render(self):
-        return wrap(_theme.group_sep_char.join([item.render() for item in self if item]))
+        return wrap(_constants.group_sep_char.join([item.render() for item in self if item]))
 
 
 def wrap(message, spacing=1):
@@ -189,11 +228,13 @@ def wrap(message, spacing=1):
     :return: wrapped message
     :rtype: str
     """
-    return (" " * spacing).join([_theme.wrap_chars_start, message, _theme.wrap_chars_end])
+    c = _constants
+    return (" " * spacing).join([c.wrap_chars_start, message, c.wrap_chars_end])
 
 
 def load_theme(theme_instance):
-    """ Sets a new theme instance as the currently active theme
+    """ Sets a new theme instance as the currently active theme. Changes made to the theme
+    after it is loaded are not picked up until it is loaded again.
 
     :param theme_instance: Theme class instance
     :type theme_instance: BaseTheme
@@ -201,10 +242,11 @@ def load_theme(theme_instance):
     :return:
     :rtype:
     """
-    global _theme
+    global _theme, _constants
     if not isinstance(theme_instance, BaseTheme):
         raise TypeError("Theme must be subclass of theme.BaseTheme")
     _theme = theme_instance
+    _constants = _ThemeConstants(theme_instance)
 
 
 def get_value(key):
@@ -223,12 +265,270 @@ def render(title=None, items=None):
         items = []
     output = []
     if title:
-        output.append(colourize(fg=_theme.title, message=title))
+        output.append("".join([_constants.title_prefix, title, NORMAL]))
     output.extend(i.render() for i in items if i)
-    output_str = _theme.sep_char.join(output)
+    output_str = _constants.sep_char.join(output)
     return output_str
 
 
+def render_many(rows, max_bytes=None, encoding="utf-8"):
+    """ Render a batch of messages in one pass, eg: a burst of announces. The output of each
+    row is identical to :func:`render` with the same title and entities.
+
+    >>> render_many([
+    >>>     ("New Torrent", [("Name", name), [("Size", size), ("Files", files)]])
+    >>>     for name, size, files in uploads
+    >>> ], max_bytes=MAX_MESSAGE_BYTES)
+
+    :param rows: (title, items) tuples. Items are (key, value) pairs rendered as an
+        :class:`Entity`, lists of pairs rendered as an :class:`EntityGroup` or any
+        :class:`Renderable`
+    :type rows: iterable
+    :param max_bytes: Split messages longer than this many encoded bytes into several lines
+        using :func:`split_message`
+    :type max_bytes: int
+    :param encoding: Encoding used to measure the length of the messages
+    :type encoding: str
+    :return: Rendered lines, in order
+    :rtype: list
+    """
+    c = _constants
+    lines = []
+    output = []
+    group = []
+    for title, items in rows:
+        del output[:]
+        if title:
+            output.append("".join([c.title_prefix, title, NORMAL]))
+        for item in items or ():
+            if not item:
+                continue
+            if isinstance(item, tuple):
+                output.append(_render_pair(item, c))
+            elif isinstance(item, Renderable):
+                output.append(item.render())
+            else:
+                del group[:]
+                group.extend(_render_pair(pair, c) for pair in item if pair)
+                output.append(" ".join([c.wrap_chars_start, c.group_sep_char.join(group),
+                                        c.wrap_chars_end]))
+        message = c.sep_char.join(output)
+        if max_bytes:
+            lines.extend(split_message(message, max_bytes, encoding))
+        else:
+            lines.append(message)
+    return lines
+
+
+def _render_pair(pair, c):
+    key, value = pair
+    value = str(value) if value is not None else ""
+    if value:
+        return "".join([c.key_prefix, str(key), NORMAL, c.value_sep, c.value_prefix, value,
+                        NORMAL])
+    return "".join([c.key_prefix, str(key), NORMAL])
+
+
+# A colour code with its optional foreground and background, or any other formatting code
+_format_code = re.compile(
+    "({0}(?:[0-9]{{1,2}}(?:,[0-9]{{1,2}})?)?|[{1}{2}{3}{4}{5}{6}{7}])".format(
+        COLOUR_CODE, BOLD_CODE, NORMAL, REVERSE, UNDERLINE, ITALIC, STRIKETHROUGH, MONOSPACE))
+
+_toggles = (BOLD_CODE, ITALIC, UNDERLINE, REVERSE, STRIKETHROUGH, MONOSPACE)
+
+# (fg, bg, enabled toggles) with nothing applied
+_PLAIN = (None, None, frozenset())
+
+
+def _apply_code(state, code):
+    fg, bg, toggles = state
+    if code == NORMAL:
+        return _PLAIN
+    if code[0] == COLOUR_CODE:
+        if len(code) == 1:
+            return None, None, toggles
+        fg, _, new_bg = code[1:].partition(",")
+        return fg, new_bg or bg, toggles
+    return fg, bg, toggles ^ {code}
+
+
+def _restore_codes(state):
+    fg, bg, toggles = state
+    codes = [t for t in _toggles if t in toggles]
+    if fg is not None:
+        codes.append("{}{:02d}".format(COLOUR_CODE, int(fg)) if bg is None else
+                     "{}{:02d},{:02d}".format(COLOUR_CODE, int(fg), int(bg)))
+    return "".join(codes)
+
+
+def _continuation_prefix(state, text):
+    prefix = _restore_codes(state)
+    if prefix and prefix[-1].isdigit() and text == ",":
+        # Keep a leading comma from being read as a background colour
+        prefix += BOLD_CODE + BOLD_CODE
+    return prefix
+
+
+def split_message(message, max_bytes=MAX_MESSAGE_BYTES, encoding="utf-8"):
+    """ Split a message into lines of at most max_bytes encoded bytes. Lines are broken at
+    the last space when possible, never inside a formatting code or a multi byte character.
+    Every continuation line starts with the codes needed to restore the colour, bold etc.
+    that were active at the break.
+
+    :param message: Message to split
+    :type message: str
+    :param max_bytes: Maximum length of a line in encoded bytes
+    :type max_bytes: int
+    :param encoding: Encoding the message will be sent with
+    :type encoding: str
+    :raises ValueError: max_bytes is too small to hold the restored formatting
+    :return: Lines in order
+    :rtype: list
+    """
+    if len(message.encode(encoding)) <= max_bytes:
+        return [message]
+    if max_bytes < 32:
+        raise ValueError("max_bytes must be at least 32")
+    lines = []
+    state = _PLAIN
+    # (text, encoded size, state after the text, is text) of the pieces making up the line
+    pieces = []
+    used = 0
+    start = 0
+    space = None
+    for i, token in enumerate(_format_code.split(message)):
+        is_code = i % 2 == 1
+        for piece in (token,) if is_code else token:
+            size = len(piece.encode(encoding))
+            # Moving the text after the last space to a new line may still not leave room
+            while used + size > max_bytes:
+                head = None
+                if space is not None and space > start:
+                    head, tail, state_at = pieces[:space], pieces[space + 1:], pieces[space][2]
+                    prefix = _continuation_prefix(state_at, tail[0][0] if tail else piece)
+                    # The restored formatting can leave the moved text too long for a line
+                    if len(prefix.encode(encoding)) + sum(p[1] for p in tail) > max_bytes:
+                        head = None
+                if head is None:
+                    head, tail, state_at = pieces, [], state
+                    prefix = _continuation_prefix(state_at, piece)
+                # A line holding only formatting codes would show up empty
+                if any(p[3] for p in head):
+                    lines.append("".join(p[0] for p in head))
+                pieces = []
+                if prefix:
+                    pieces.append((prefix, len(prefix.encode(encoding)), state_at, False))
+                start = len(pieces)
+                space = None
+                for p in tail:
+                    if p[0] == " ":
+                        space = len(pieces)
+                    pieces.append(p)
+                used = sum(p[1] for p in pieces)
+            if is_code:
+                state = _apply_code(state, piece)
+            elif piece == " ":
+                space = len(pieces)
+            pieces.append((piece, size, state, not is_code))
+            used += size
+    if any(p[3] for p in pieces):
+        lines.append("".join(p[0] for p in pieces))
+    return lines
+
+
+class Template(object):
+    """ A precompiled message layout, the output is identical to :func:`render` but the
+    title and keys are coloured once and the result turned into a single format string.
+    Only the values are supplied for each message.
+
+    The layout is a sequence of keys, each rendered as an :class:`Entity`, or sequences of
+    keys rendered as an :class:`EntityGroup`. Values are given in the same order as the keys,
+    a None or empty value renders only the key like ``Entity(key)`` would.
+
+    >>> announce = Template("New Torrent", ["Name", ("Size", "Files")])
+    >>> announce.render(["Show.S01E01.720p", "1.2 GB", 3])
+
+    The template is recompiled automatically when a new theme is loaded.
+
+    :param title: Title of the message
+    :type title: str
+    :param layout: Entity keys and groups of keys
+    :type layout: list
+    """
+
+    __slots__ = ('title', 'layout', 'size', '_version', '_format', '_items')
+
+    def __init__(self, title=None, layout=()):
+        self.title = title
+        self.layout = tuple(k if isinstance(k, str) else tuple(k) for k in layout)
+        self.size = sum(1 if isinstance(k, str) else len(k) for k in self.layout)
+        self._version = None
+        self._format = None
+        self._items = None
+
+    def _compile(self):
+        c = _constants
+
+        def entity(key):
+            key = "".join([c.key_prefix, str(key), NORMAL])
+            # (key only, key with the prefix of its value)
+            return key, "".join([key, c.value_sep, c.value_prefix])
+
+        items = []
+        for item in self.layout:
+            items.append(entity(item) if isinstance(item, str) else [entity(k) for k in item])
+        fmt = []
+        if self.title:
+            fmt.append(_escape("".join([c.title_prefix, self.title, NORMAL])))
+        for item in items:
+            if isinstance(item, tuple):
+                fmt.append(_escape(item[1]) + "{}" + NORMAL)
+            else:
+                fmt.append(" ".join([
+                    _escape(c.wrap_chars_start),
+                    _escape(c.group_sep_char).join(_escape(e[1]) + "{}" + NORMAL for e in item),
+                    _escape(c.wrap_chars_end)
+                ]))
+        self._format = _escape(c.sep_char).join(fmt)
+        self._items = items
+        self._version = c
+
+    def render(self, values=()):
+        """ Render a message
+
+        :param values: One value for each key in the layout
+        :type values: list
+        :return: Rendered message
+        :rtype: str
+        """
+        if self._version is not _constants:
+            self._compile()
+        values = [str(v) if v is not None else "" for v in values]
+        if len(values) != self.size:
+            raise ValueError("Expected {} values, got {}".format(self.size, len(values)))
+        if "" not in values:
+            return self._format.format(*values)
+        # Some entities only render their key, build the message piece by piece
+        values = iter(values)
+        c = _constants
+        output = ["".join([c.title_prefix, self.title, NORMAL])] if self.title else []
+        for item in self._items:
+            if isinstance(item, tuple):
+                output.append(_render_entity(item, next(values)))
+            else:
+                output.append(wrap(c.group_sep_char.join(
+                    [_render_entity(e, next(values)) for e in item])))
+        return c.sep_char.join(output)
+
+
+def _render_entity(entity, value):
+    return "".join([entity[1], value, NORMAL]) if value else entity[0]
+
+
+def _escape(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
 def render_error(message, command=None):
     """ Returns a error message in a standardized format
 
@@ -3,15 +3,30 @@
 This module is used to communicate with mika's API
 """
 from __future__ import absolute_import, print_function, unicode_literals
+import json
+import os
 import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock
+from operator import attrgetter, itemgetter
 from urllib.parse import unquote_plus
 import redis
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from http import client as httplib
-from totv import exc
+from totv import exc, jsonutil
+from totv.cache import LRUCache, MISSING, SingleFlight
+from totv.extsort import external_sort
+from totv.metrics import Metrics, endpoint_name
+from totv.records import Peer, Torrent, TorrentCounts, User
 
 _base_url = ""
 _api_key = ""
+_bot_client = None
 
 MSG_OK = 200
 MSG_INVALID_REQ_TYPE = 100
@@ -55,42 +70,377 @@ def configure(base_url, key):
     :param key: Bots API Key
     :type key: str
     """
-    global _base_url, _api_key
+    global _base_url, _api_key, _bot_client
     _base_url = base_url
     _api_key = key
+    if _bot_client is not None:
+        _bot_client.close()
+        _bot_client = None
 
 
 def bot_api_request(endpoint, method='GET', payload=None):
     """ Make an HTTP api request to the tracker using the configured irc key
 
-    :param endpoint:
-    :type endpoint:
-    :param method:
-    :type method:
-    :param payload:
-    :type payload:
-    :return:
+    Kept for backwards compatibility, this uses a shared :class:`BotAPIClient` built from
+    the values passed to :func:`configure`.
+
+    :param endpoint: API endpoint, appended to the base url
+    :type endpoint: str
+    :param method: HTTP method, anything other than POST is sent as a GET
+    :type method: str
+    :param payload: Body sent with POST requests
+    :type payload: str, dict
+    :return: Decoded response
     :rtype: dict
     """
-    url = _base_url + endpoint
-    headers = {
-        'X-IRCBOT-API-KEY': _api_key,
+    global _bot_client
+    if _bot_client is None:
+        _bot_client = BotAPIClient(_base_url, _api_key)
+    return _bot_client.request(endpoint, 'POST' if method == 'POST' else 'GET', payload)
+
+
+class BotAPIClient(object):
+    """ Client for the site bot API authenticated using the irc bot key. Connections are
+    kept alive in a pool and reused between requests.
+
+    >>> bot_api = BotAPIClient("https://example.com/api/bot", key)
+    >>> bot_api.request("/user/1")
+    >>> bot_api.batch([("/announce", "POST", msg) for msg in messages], concurrency=8)
+
+    :param base_url: Base url used for requests
+    :type base_url: str
+    :param api_key: Bots API Key
+    :type api_key: str
+    :param timeout: Seconds to wait for the server before giving up on a request
+    :type timeout: float
+    :param pool_maxsize: Maximum number of keep-alive connections kept per host, a hard
+        limit only with pool_block
+    :type pool_maxsize: int
+    :param max_retries: Number of times to retry failed connections and gateway errors
+    :type max_retries: int
+    :param backoff_factor: Exponential backoff factor applied between retries
+    :type backoff_factor: float
+    :param pool_block: Wait for a free pooled connection instead of opening more than
+        pool_maxsize connections
+    :type pool_block: bool
+    """
+
+    def __init__(self, base_url, api_key, timeout=5, pool_maxsize=10, max_retries=3,
+                 backoff_factor=0.3, pool_block=False):
+        self._base_url = base_url
+        self._timeout = timeout
+        self._pool_maxsize = pool_maxsize
+        self._session = make_session(pool_connections=1, pool_maxsize=pool_maxsize,
+                                     max_retries=max_retries, backoff_factor=backoff_factor,
+                                     pool_block=pool_block)
+        self._session.headers.update(bot_api_headers(api_key))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """ Close all pooled connections held by the client """
+        self._session.close()
+
+    def request(self, endpoint, method='GET', payload=None):
+        """ Make a request to the bot API
+
+        :param endpoint: API endpoint, appended to the base url
+        :type endpoint: str
+        :param method: HTTP method
+        :type method: str
+        :param payload: Request body, a str or bytes body is sent as is and anything else is
+            JSON encoded
+        :type payload: str, dict
+        :return: Decoded response
+        :rtype: dict
+        """
+        kwargs = {}
+        if payload is not None:
+            kwargs['data' if isinstance(payload, (str, bytes)) else 'json'] = payload
+        resp = self._session.request(method, self._base_url + endpoint, timeout=self._timeout,
+                                     **kwargs)
+        return jsonutil.loads(resp.content)
+
+    def batch(self, calls, concurrency=None):
+        """ Send many requests concurrently, at most concurrency at a time
+
+        A failed request does not abort the others, its exception is returned in place of
+        the response.
+
+        :param calls: (endpoint, method, payload) tuples or dicts of :meth:`request` arguments
+        :type calls: iterable
+        :param concurrency: Maximum number of concurrent requests, defaults to pool_maxsize
+        :type concurrency: int
+        :return: Response or exception for each call, in the same order as calls
+        :rtype: list
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=max(concurrency or self._pool_maxsize, 1)) as executor:
+            futures = [executor.submit(call_item, self.request, call) for call in calls]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except (requests.RequestException, ValueError) as err:
+                    results.append(err)
+        return results
+
+
+def bot_api_headers(api_key):
+    """ Headers sent with every bot API request """
+    return {
+        'X-IRCBOT-API-KEY': api_key,
         'Content-type': 'application/json',
         'Accept': 'application/json'
     }
-    if method == 'GET':
-        r = requests.get(url, headers=headers)
-    elif method == 'POST':
-        r = requests.post(url, headers=headers, data=payload)
+
+
+def make_session(pool_connections=4, pool_maxsize=10, max_retries=3, backoff_factor=0.3,
+                 pool_block=False):
+    """ Create a keep-alive HTTP session with pooled connections and a retry policy
+
+    Connection errors and gateway errors (502, 503, 504) are retried with an exponential
+    backoff. Only idempotent methods are retried on a bad status so a POST will never be
+    submitted twice.
+
+    :param pool_connections: Number of per-host connection pools to cache
+    :type pool_connections: int
+    :param pool_maxsize: Maximum number of keep-alive connections kept per host. Without
+        pool_block more connections are opened under load, those are closed after use.
+    :type pool_maxsize: int
+    :param max_retries: Number of times to retry a failed request, 0 to disable
+    :type max_retries: int
+    :param backoff_factor: Exponential backoff factor applied between retries
+    :type backoff_factor: float
+    :param pool_block: Wait for a pooled connection to be free instead of opening more
+        than pool_maxsize connections to a host
+    :type pool_block: bool
+    :return: Configured session
+    :rtype: requests.Session
+    """
+    retry = Retry(total=max_retries, connect=max_retries, read=0, status=max_retries,
+                  backoff_factor=backoff_factor, status_forcelist=(502, 503, 504),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                          max_retries=retry, pool_block=pool_block)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_redis_pool(host="localhost", port=6379, db=0, url=None, unix_socket_path=None,
+                    max_connections=None, socket_keepalive=False, health_check_interval=0,
+                    pool_class=redis.ConnectionPool):
+    """ Create a redis connection pool
+
+    :param host: Redis host
+    :type host: str
+    :param port: Redis port
+    :type port: int
+    :param db: Redis database to use, a db given in the url takes precedence
+    :type db: int
+    :param url: Redis url, eg: redis://:password@localhost:6379/0, overrides host and port
+    :type url: str
+    :param unix_socket_path: Connect over a unix socket instead of TCP
+    :type unix_socket_path: str
+    :param max_connections: Maximum number of connections opened by the pool, None for no limit
+    :type max_connections: int
+    :param socket_keepalive: Enable TCP keepalive on the connections
+    :type socket_keepalive: bool
+    :param health_check_interval: Seconds a connection can be idle before it is checked with a
+        PING when next used, 0 to disable
+    :type health_check_interval: int
+    :param pool_class: Pool class to create, redis.asyncio.ConnectionPool for asyncio clients
+    :type pool_class: type
+    :rtype: redis.ConnectionPool
+    """
+    if unix_socket_path:
+        url = "unix://{}".format(unix_socket_path)
+    kwargs = dict(db=int(db), max_connections=max_connections,
+                  health_check_interval=health_check_interval)
+    if not unix_socket_path:
+        kwargs['socket_keepalive'] = socket_keepalive
+    if url:
+        return pool_class.from_url(url, **kwargs)
+    return pool_class(host=host, port=int(port), **kwargs)
+
+
+_redis_pools = {}
+_redis_pools_lock = Lock()
+
+
+def get_redis_pool(host="localhost", port=6379, db=0, url=None, unix_socket_path=None, **kwargs):
+    """ Get the process wide redis pool for a server and database, creating it on first use.
+    Clients built with the same host/port/db then share their connections instead of each
+    opening their own.
+
+    The remaining keyword arguments are passed to :func:`make_redis_pool` and only apply
+    when the pool is created.
+
+    :rtype: redis.ConnectionPool
+    """
+    if url:
+        key = (url, int(db))
+    elif unix_socket_path:
+        key = (unix_socket_path, int(db))
     else:
-        r = requests.get(url, headers=headers)
-    return r.json()
+        key = (host, int(port), int(db))
+    with _redis_pools_lock:
+        pool = _redis_pools.get(key)
+        if pool is None:
+            pool = _redis_pools[key] = make_redis_pool(
+                host, port, db, url=url, unix_socket_path=unix_socket_path, **kwargs)
+        return pool
+
+
+def close_redis_pools():
+    """ Disconnect and forget every pool held by the process wide registry """
+    with _redis_pools_lock:
+        for pool in _redis_pools.values():
+            pool.disconnect()
+        _redis_pools.clear()
+
+
+def chunks(iterable, size):
+    """ Split an iterable into lists of at most size items without materialising it
+
+    :param iterable: Items to split
+    :type iterable: iterable
+    :param size: Maximum number of items in each chunk
+    :type size: int
+    :return: Generator of item lists
+    :rtype: generator
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def check_status(status_code, valid_codes=None):
+    """ Raise the appropriate exception for an unsuccessful tracker API status code
+
+    :param status_code: HTTP status code returned by the tracker
+    :type status_code: int
+    :param valid_codes: Additional error status codes that should not raise
+    :type valid_codes: list
+    :raises exc.NotFoundError, exc.DuplicateError, exc.BadResponse:
+    """
+    if status_code == httplib.NOT_FOUND:
+        raise exc.NotFoundError("Entity not found")
+    elif status_code == httplib.CONFLICT:
+        raise exc.DuplicateError("Entity already exists")
+    elif status_code >= httplib.BAD_REQUEST and status_code not in (valid_codes or []):
+        raise exc.BadResponse("Received bad response from server: {}".format(status_code))
+
+
+def user_from_redis(data):
+    """ Convert a raw user hash as stored in redis into a user dict
+
+    :param data: Raw user hash as returned by HGETALL
+    :type data: dict
+    :return: Decoded user
+    :rtype: dict
+    """
+    return {
+        'passkey': data.get(b'passkey', "ERROR: PASSKEY NOT SET"),
+        'user_id': int(data.get(b'user_id', b"-1")),
+        'downloaded': int(data.get(b'downloaded', b"-1")),
+        'uploaded': int(data.get(b'uploaded', b"-1")),
+        'username': data.get(b'username', b"ERROR: NO USER!").decode(),
+        'enabled': data.get(b'enabled', b"0").decode()
+    }
 
 
 _ih_rx = re.compile("^[0-9a-zA-Z]{40}$")
 
 
+class InfoHash(bytes):
+    """ A torrent info hash stored as its raw 20 bytes rather than 40 hex characters.
+
+    Formatting an InfoHash with str() gives the hex form used by the tracker API, so it can
+    be passed anywhere an info hash string is accepted.
+
+    >>> ih = InfoHash("9c2f8f7f4996b2853509247504681dbe98e5d0c1")
+    >>> str(ih)
+    '9c2f8f7f4996b2853509247504681dbe98e5d0c1'
+    >>> len(ih)
+    20
+
+    :param value: 40 character hex string or 20 raw bytes
+    :type value: str, bytes
+    :raises exc.ValidationError:
+    """
+    __slots__ = ()
+
+    def __new__(cls, value):
+        if type(value) is cls:
+            return value
+        raw = value
+        if isinstance(value, str):
+            try:
+                raw = bytes.fromhex(value) if len(value) == 40 else b""
+            except ValueError:
+                raw = b""
+        if not isinstance(raw, (bytes, bytearray, memoryview)) or len(raw) != 20:
+            raise exc.ValidationError("Invalid info_hash supplied: {}".format(value))
+        return bytes.__new__(cls, raw)
+
+    def __str__(self):
+        return self.hex()
+
+    def __repr__(self):
+        return "InfoHash('{}')".format(self.hex())
+
+    def __reduce__(self):
+        return InfoHash, (bytes(self),)
+
+
+def validate_info_hashes(info_hashes):
+    """ Validate and convert a batch of info hashes into InfoHash instances in a single pass.
+
+    Hex strings are concatenated and decoded with one bytes.fromhex call, items are only
+    checked individually to report the offending value when the batch is invalid. Numpy
+    arrays of 20 byte values (S20 or V20) are copied out with a single tobytes call.
+
+    :param info_hashes: Hex strings, raw 20 byte values or InfoHash instances
+    :type info_hashes: iterable
+    :raises exc.ValidationError: If any of the info hashes is invalid
+    :return: Converted info hashes in the same order
+    :rtype: []InfoHash
+    """
+    dtype = getattr(info_hashes, "dtype", None)
+    if dtype is not None and dtype.kind in "SV" and dtype.itemsize == 20:
+        # Viewed as V20 since tolist() strips the trailing null bytes of S20 values
+        raw = info_hashes.reshape(-1).view("V20").tobytes()
+        return [InfoHash(raw[i:i + 20]) for i in range(0, len(raw), 20)]
+    if hasattr(info_hashes, "tolist"):
+        # Other numpy arrays, eg: of hex strings
+        info_hashes = info_hashes.tolist()
+    info_hashes = list(info_hashes)
+    if all(type(ih) is str for ih in info_hashes):
+        hex_hashes = "".join(info_hashes)
+        raw = b""
+        if len(hex_hashes) == 40 * len(info_hashes):
+            try:
+                raw = bytes.fromhex(hex_hashes)
+            except ValueError:
+                pass
+        # fromhex ignores whitespace, so the decoded length must also be checked
+        if len(raw) == 20 * len(info_hashes):
+            return [InfoHash(raw[i:i + 20]) for i in range(0, len(raw), 20)]
+    return [InfoHash(ih) for ih in info_hashes]
+
+
 def validate_info_hash(info_hash):
+    if type(info_hash) is InfoHash:
+        return info_hash.hex()
     info_hash = str(info_hash)
     if not _ih_rx.match(info_hash):
         raise exc.ValidationError("Invalid info_hash supplied: {}".format(info_hash))
@@ -103,6 +453,224 @@ def validate_torrent_id(torrent_id):
     return torrent_id
 
 
+def unquote_peers(peers):
+    """ Decode the url encoded peer ids of a peer list in place
+
+    :param peers: Peers as returned by the /torrent/{info_hash}/peers endpoint
+    :type peers: []dict
+    :return: The same peer list
+    :rtype: []dict
+    """
+    for peer in peers:
+        peer_id = peer['peer_id']
+        # Most peer ids are plain ascii, skip the unquote call for those
+        if "%" in peer_id or "+" in peer_id:
+            peer['peer_id'] = unquote_plus(peer_id)
+    return peers
+
+
+class BulkResult(object):
+    """ Outcome of a bulk write, every submitted item ends up in exactly one of the groups.
+    Items are kept in the same order they were submitted.
+
+    :ivar ok: Items that were written successfully
+    :ivar duplicate: Items that already existed on the tracker
+    :ivar invalid: (item, error) tuples for items that failed validation
+    :ivar failed: (item, error) tuples for items that failed for any other reason
+    """
+
+    def __init__(self):
+        self.ok = []
+        self.duplicate = []
+        self.invalid = []
+        self.failed = []
+
+    def __len__(self):
+        return len(self.ok) + len(self.duplicate) + len(self.invalid) + len(self.failed)
+
+    def add(self, item, error=None):
+        """ Record the outcome of a single item
+
+        :param item: Submitted item
+        :param error: Exception raised while writing the item, if any
+        :type error: Exception
+        """
+        if error is None:
+            self.ok.append(item)
+        elif isinstance(error, exc.DuplicateError):
+            self.duplicate.append(item)
+        elif isinstance(error, exc.ValidationError):
+            self.invalid.append((item, error))
+        else:
+            self.failed.append((item, error))
+
+
+def call_item(func, item):
+    """ Call func using a bulk item as its arguments, dicts are passed as keyword
+    arguments and any other sequence as positional arguments
+    """
+    if isinstance(item, dict):
+        return func(**item)
+    return func(*item)
+
+
+# Integer fields checked by Client.cleanup for each hash type
+USER_INT_FIELDS = (b'downloaded', b'uploaded', b'snatches', b'announces', b'corrupt')
+TORRENT_INT_FIELDS = (b'downloaded', b'uploaded', b'snatches', b'announces', b'seeders',
+                      b'leechers')
+
+# Problem classes reported by Client.cleanup
+STALE_KEY = "stale_key"
+WRONG_TYPE = "wrong_type"
+MISSING_FIELD = "missing_field"
+INVALID_INT = "invalid_int"
+NEGATIVE_INT = "negative_int"
+INT_OVERFLOW = "int_overflow"
+
+# Nothing should be this large yet, even if not max int size
+MAX_INT = 2 ** 62
+
+
+# Checks the integer fields of a batch of hashes on the server so their contents never
+# cross the network. Keys are the hashes to check, ARGV is the update flag ("1" to reset
+# invalid fields to 0), MAX_INT and the field names. Only hashes with problems are returned
+# as {key, field, problem, ...}, keys that are not hashes as {key, "", "wrong_type"}.
+REPAIR_INT_FIELDS_LUA = """
+local update = ARGV[1] == "1"
+local max_int = ARGV[2]
+local changed = {}
+for _, key in ipairs(KEYS) do
+    local key_type = redis.call("TYPE", key)["ok"]
+    if key_type == "hash" then
+        local entry = {key}
+        for i = 3, #ARGV do
+            local field = ARGV[i]
+            local value = redis.call("HGET", key, field)
+            local problem = nil
+            if not value then
+                problem = "missing_field"
+            else
+                local sign, digits = string.match(value, "^%s*([+-]?)(%d+)%s*$")
+                if not sign then
+                    problem = "invalid_int"
+                else
+                    digits = string.gsub(digits, "^0+", "")
+                    if sign == "-" and digits ~= "" then
+                        problem = "negative_int"
+                    elseif #digits > #max_int or (#digits == #max_int and digits > max_int) then
+                        problem = "int_overflow"
+                    end
+                end
+            end
+            if problem then
+                table.insert(entry, field)
+                table.insert(entry, problem)
+                if update then
+                    redis.call("HSET", key, field, 0)
+                end
+            end
+        end
+        if #entry > 1 then
+            table.insert(changed, entry)
+        end
+    elseif key_type ~= "none" then
+        table.insert(changed, {key, "", "wrong_type"})
+    end
+end
+return changed
+"""
+
+
+class CleanupReport(object):
+    """ Outcome of a :meth:`Client.cleanup` run, safe to update from several threads
+
+    :ivar scanned: Number of keys inspected
+    :ivar problems: Number of problems found for each problem class
+    :ivar samples: Up to sample_size example keys for each problem class
+    :ivar deleted: Number of stale keys deleted
+    :ivar fixed: Number of hashes that had fields reset
+    :ivar cursors: Last completed SCAN cursor of each shard, None once a shard is finished
+    """
+
+    def __init__(self, sample_size=10, cursors=None):
+        self.sample_size = sample_size
+        self.scanned = 0
+        self.problems = {}
+        self.samples = {}
+        self.deleted = 0
+        self.fixed = 0
+        self.cursors = dict(cursors or {})
+        self._lock = Lock()
+
+    @property
+    def complete(self):
+        """ True once every shard has been scanned to the end """
+        return all(cursor is None for cursor in self.cursors.values())
+
+    def add(self, problem, key):
+        """ Record a single problem
+
+        :param problem: Problem class, eg: STALE_KEY
+        :type problem: str
+        :param key: Redis key the problem was found in
+        :type key: bytes
+        """
+        with self._lock:
+            self.problems[problem] = self.problems.get(problem, 0) + 1
+            samples = self.samples.setdefault(problem, [])
+            if isinstance(key, bytes):
+                key = key.decode(errors="replace")
+            if len(samples) < self.sample_size and key not in samples:
+                samples.append(key)
+
+    def count(self, scanned=0, deleted=0, fixed=0):
+        with self._lock:
+            self.scanned += scanned
+            self.deleted += deleted
+            self.fixed += fixed
+
+    def to_dict(self):
+        """ Convert the report into a JSON serialisable dict
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'scanned': self.scanned,
+                'problems': dict(self.problems),
+                'samples': {k: list(v) for k, v in self.samples.items()},
+                'deleted': self.deleted,
+                'fixed': self.fixed,
+                'cursors': dict(self.cursors),
+                'complete': self.complete
+            }
+
+    def __repr__(self):
+        return "<CleanupReport(scanned={}, problems={}, deleted={}, fixed={})>".format(
+            self.scanned, self.problems, self.deleted, self.fixed)
+
+
+def _stale_user_key(key):
+    # Active/inactive user suffix keys etc. t:u:$id:*
+    return len(key.split(b":")) != 3
+
+
+def _stale_torrent_key(key):
+    # Peer suffix keys t:t:$ih:*, keys holding a stringified bytes info hash and the
+    # old int based keys. A hex info hash can be all digits so only short ids are int keys.
+    k = key.split(b":")
+    if len(k) != 3 or k[2].startswith(b"b'"):
+        return True
+    return len(k[2]) != 40 and k[2].isdigit()
+
+
+# (SCAN pattern, stale key check, integer fields) for each cleanup shard
+CLEANUP_SHARDS = (
+    ("t:u:*", _stale_user_key, USER_INT_FIELDS),
+    ("t:t:*", _stale_torrent_key, TORRENT_INT_FIELDS)
+)
+
+
 class Client(object):
     """ A simple API client used to communicate with the tracker
 
@@ -116,59 +684,236 @@ class Client(object):
     :type redis_db: int
     :param verify: Verify tracker SSL cert
     :type verify: bool
+    :param pool_connections: Number of per-host connection pools to cache
+    :type pool_connections: int
+    :param pool_maxsize: Maximum number of keep-alive connections kept per host, a hard
+        limit only with pool_block
+    :type pool_maxsize: int
+    :param max_retries: Number of times to retry failed connections and gateway errors
+    :type max_retries: int
+    :param backoff_factor: Exponential backoff factor applied between retries
+    :type backoff_factor: float
+    :param scan_count: COUNT hint passed to redis SCAN when walking the keyspace
+    :type scan_count: int
+    :param batch_size: Number of redis reads sent in each pipeline by the bulk readers
+    :type batch_size: int
+    :param user_cache_size: Number of users kept in the write-through user cache, 0 to disable
+    :type user_cache_size: int
+    :param user_cache_ttl: Seconds a cached user stays valid. Transfer stats change on the
+        tracker as users announce, so keep this short.
+    :type user_cache_ttl: float
+    :param response_cache: Cache used for the read only endpoints
+    :type response_cache: totv.cache.ResponseCache
+    :param coalesce: Share a single request and decoded result between identical concurrent
+        GET requests. Off by default since the results are then shared between threads and
+        must not be mutated.
+    :type coalesce: bool
+    :param redis_pool: Existing redis connection pool to use, the other redis options are
+        ignored when set
+    :type redis_pool: redis.ConnectionPool
+    :param redis_url: Redis url, overrides redis_host and redis_port
+    :type redis_url: str
+    :param redis_unix_socket: Connect to redis over a unix socket
+    :type redis_unix_socket: str
+    :param redis_max_connections: Maximum number of connections in the redis pool
+    :type redis_max_connections: int
+    :param redis_socket_keepalive: Enable TCP keepalive on the redis connections
+    :type redis_socket_keepalive: bool
+    :param redis_health_check_interval: Seconds an idle redis connection is trusted before
+        being checked with a PING, 0 to disable
+    :type redis_health_check_interval: int
+    :param share_redis_pool: Use the process wide pool from :func:`get_redis_pool` so every
+        client connecting to the same server and db shares its connections
+    :type share_redis_pool: bool
+    :param metrics: Metrics recorder shared with other clients, a new one is used by default
+    :type metrics: totv.metrics.Metrics
+    :param pool_block: Wait for a free pooled connection instead of opening more than
+        pool_maxsize connections
+    :type pool_block: bool
     """
 
     def __init__(self, api_uri, username="dev", password="dev", redis_host="localhost",
-                 redis_port=6379, redis_db=0, verify=False, timeout=3):
+                 redis_port=6379, redis_db=0, verify=False, timeout=3, pool_connections=4,
+                 pool_maxsize=10, max_retries=3, backoff_factor=0.3, scan_count=1000,
+                 batch_size=1000, user_cache_size=0, user_cache_ttl=30, response_cache=None,
+                 coalesce=False, redis_pool=None, redis_url=None, redis_unix_socket=None,
+                 redis_max_connections=None, redis_socket_keepalive=False,
+                 redis_health_check_interval=0, share_redis_pool=False, metrics=None,
+                 pool_block=False):
         self._api_uri = api_uri
         self._auth = (username, password) if username and password else None
         self._redis_host = redis_host
         self._redis_port = redis_port
         self._redis_db = redis_db
-        self._redis = redis.StrictRedis(host=redis_host, port=int(redis_port), db=int(redis_db))
+        if redis_pool is None:
+            redis_pool = (get_redis_pool if share_redis_pool else make_redis_pool)(
+                redis_host, redis_port, redis_db, url=redis_url,
+                unix_socket_path=redis_unix_socket, max_connections=redis_max_connections,
+                socket_keepalive=redis_socket_keepalive,
+                health_check_interval=redis_health_check_interval)
+        self._redis = redis.StrictRedis(connection_pool=redis_pool)
         self._verify = verify
         self._timeout = timeout
+        self._session = make_session(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                     max_retries=max_retries, backoff_factor=backoff_factor,
+                                     pool_block=pool_block)
+        self._session.auth = self._auth
+        self._session.verify = verify
+        self._scan_count = scan_count
+        self._batch_size = batch_size
+        self._user_cache = LRUCache(user_cache_size, user_cache_ttl) if user_cache_size else None
+        self._response_cache = response_cache
+        self._flight = SingleFlight() if coalesce else None
+        self._repair_script = None
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-    def _request(self, path, method='get', payload=None, valid_codes=None):
+    def close(self):
+        """ Close all pooled connections held by the client """
+        self._session.close()
+
+    def _request(self, path, method='get', payload=None, valid_codes=None, stream=False):
         if valid_codes is None:
             valid_codes = []
-        if method == "get":
-            resp = requests.get(self._make_url(path), verify=self._verify, auth=self._auth, timeout=self._timeout)
-        elif method == "post":
-            resp = requests.post(self._make_url(path), json=payload, verify=self._verify,
-                                 auth=self._auth, timeout=self._timeout)
-        elif method == "delete":
-            resp = requests.delete(self._make_url(path), verify=self._verify, auth=self._auth, timeout=self._timeout)
-        else:
+        if method not in ("get", "post", "delete"):
             raise NotImplementedError("Unsupported HTTP method: {}".format(method))
-        if resp.status_code == httplib.NOT_FOUND:
-            raise exc.NotFoundError("Entity not found")
-        elif resp.status_code == httplib.CONFLICT:
-            raise exc.DuplicateError("Entity already exists")
-        elif not resp.ok and resp.status_code not in valid_codes:
-            raise exc.BadResponse("Received bad response from server: {}".format(resp.status_code))
-        else:
-            return resp
+        start = time.perf_counter()
+        try:
+            # verify is passed with every request, REQUESTS_CA_BUNDLE overrides session.verify
+            if method == "get":
+                resp = self._session.get(self._make_url(path), timeout=self._timeout,
+                                         verify=self._verify, stream=stream)
+            elif method == "post":
+                resp = self._session.post(self._make_url(path), json=payload,
+                                          timeout=self._timeout, verify=self._verify)
+            else:
+                resp = self._session.delete(self._make_url(path), timeout=self._timeout,
+                                            verify=self._verify)
+        except requests.RequestException as err:
+            self.metrics.record(endpoint_name(method, path), time.perf_counter() - start,
+                                error=err.__class__.__name__)
+            raise
+        elapsed = time.perf_counter() - start
+        # Streamed bodies have not been read yet, fall back on the announced length
+        nbytes = int(resp.headers.get("Content-Length", 0)) if stream else len(resp.content)
+        try:
+            check_status(resp.status_code, valid_codes)
+        except exc.TrackerError as err:
+            self.metrics.record(endpoint_name(method, path), elapsed, nbytes,
+                                err.__class__.__name__)
+            resp.close()
+            raise
+        self.metrics.record(endpoint_name(method, path), elapsed, nbytes)
+        return resp
+
+    def _get_json(self, path, decode=None):
+        """ Make a GET request and return the decoded json body. With coalesce set,
+        identical requests made concurrently from other threads share the same HTTP call and
+        decoded result.
+
+        :param path: API path to fetch
+        :type path: str
+        :param decode: Optional function applied once to the decoded body
+        :type decode: callable
+        """
+        def fetch():
+            body = jsonutil.loads(self._request(path).content)
+            return decode(body) if decode else body
+        if self._flight is None:
+            return fetch()
+        return self._flight.do((path, self._auth), fetch)
 
     def _make_url(self, path):
         return "".join([self._api_uri, path])
 
+    def _cached(self, endpoint, key, fetch):
+        if self._response_cache is None:
+            return fetch()
+        return self._response_cache.get_or_fetch(endpoint, key, fetch)
+
+    def _invalidate(self, *keys):
+        if self._response_cache is not None:
+            for key in keys:
+                self._response_cache.invalidate(key)
+
     def version(self):
-        return self._request("/version").json()
+        return self._cached("version", "version", lambda: self._get_json("/version"))
 
     def uptime(self):
-        return self._request("/uptime").json()
+        return self._cached("uptime", "uptime", lambda: self._get_json("/uptime"))
 
     def torrent_get(self, info_hash):
-        return self._request("/torrent/{}".format(validate_info_hash(info_hash))).json()
+        info_hash = validate_info_hash(info_hash)
+        return self._cached("torrent_get", "torrent_get:{}".format(info_hash),
+                            lambda: self._get_json("/torrent/{}".format(info_hash)))
+
+    def _torrent_get_or_none(self, info_hash):
+        try:
+            torrent = self.torrent_get(info_hash)
+        except exc.NotFoundError:
+            return None
+        if type(info_hash) is InfoHash:
+            # Copy, the decoded response may be shared with other callers
+            torrent = dict(torrent, info_hash=info_hash)
+        return torrent
+
+    def torrent_get_iter(self, torrent_ids, concurrency=1):
+        """ Lazily look up a sequence of torrents, yielding results in the same order
+        as the input as soon as they are available.
+
+        With a concurrency above 1 the lookups are spread over a bounded thread pool. Only
+        a small window of requests is ever in flight, so very large (or unbounded) inputs
+        can be streamed without queueing every request up front. The clients pool_maxsize
+        should be at least as large as the concurrency to keep all connections alive.
 
-    def torrent_get_all(self, torrent_ids):
+        :param torrent_ids: Info hashes to look up, torrents looked up using an
+            :class:`InfoHash` have their info_hash returned as an InfoHash too
+        :type torrent_ids: iterable
+        :param concurrency: Maximum number of concurrent requests
+        :type concurrency: int
+        :return: Generator of (info_hash, torrent) tuples, torrent is None when not found
+        :rtype: generator
+        """
+        if concurrency <= 1:
+            for info_hash in torrent_ids:
+                yield info_hash, self._torrent_get_or_none(info_hash)
+            return
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            for info_hash in torrent_ids:
+                pending.append((info_hash, executor.submit(self._torrent_get_or_none, info_hash)))
+                if len(pending) >= concurrency * 2:
+                    info_hash, future = pending.popleft()
+                    yield info_hash, future.result()
+            while pending:
+                info_hash, future = pending.popleft()
+                yield info_hash, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def torrent_get_all(self, torrent_ids, concurrency=1):
+        """ Look up a list of torrents, splitting them into found and not found results.
+        Both lists keep the order of the input.
+
+        :param torrent_ids: Info hashes to look up
+        :type torrent_ids: iterable
+        :param concurrency: Maximum number of concurrent requests
+        :type concurrency: int
+        :return: Found torrents, info hashes that were not found
+        :rtype: list, list
+        """
         found, not_found = [], []
-        for info_hash in torrent_ids:
-            try:
-                found.append(self.torrent_get(info_hash))
-            except exc.NotFoundError:
+        for info_hash, torrent in self.torrent_get_iter(torrent_ids, concurrency=concurrency):
+            if torrent is None:
                 not_found.append(info_hash)
+            else:
+                found.append(torrent)
         return found, not_found
 
     def torrent_add(self, info_hash, torrent_id, name):
@@ -179,10 +924,13 @@ class Client(object):
             'torrent_id': validate_torrent_id(torrent_id),
             'name': name
         }
-        return self._request("/torrent", method='post', payload=pl)
+        resp = self._request("/torrent", method='post', payload=pl)
+        self._invalidate("torrent_get:{}".format(pl['info_hash']))
+        return resp
 
     def torrent_del(self, info_hash):
         resp = self._request("/torrent/{}".format(info_hash), method='delete')
+        self._invalidate("torrent_get:{}".format(info_hash), "get_torrent_peers:{}".format(info_hash))
         if resp.ok:
             return True
         elif resp.status_code == httplib.NOT_FOUND:
@@ -190,17 +938,16 @@ class Client(object):
         else:
             raise exc.BadResponse("Invalid response returned from tracker")
 
-    def get_torrent_peers(self, info_hash):
-        resp = self._request("/torrent/{}/peers".format(validate_info_hash(info_hash)))
-        if resp.ok:
-            peers = resp.json()
-            for peer in peers:
-                peer['peer_id'] = unquote_plus(peer['peer_id'])
-            return peers
-        else:
-            raise Exception("ahh")
+    def get_torrent_peers(self, info_hash, records=False):
+        info_hash = validate_info_hash(info_hash)
+        peers = self._cached("get_torrent_peers", "get_torrent_peers:{}".format(info_hash),
+                             lambda: self._get_json("/torrent/{}/peers".format(info_hash),
+                                                    decode=unquote_peers))
+        if records:
+            return [Peer.from_json(peer) for peer in peers]
+        return peers
 
-    def get_torrent_counts(self):
+    def get_torrent_counts(self, records=False):
         """ Fetch and return a list of dictionary objects containing the current
         data related to seeder/leeder/snatch counts for all torrents currently
         tracked in the tracker
@@ -215,10 +962,46 @@ class Client(object):
                 }, ...
             ]
 
+        :param records: Return :class:`totv.records.TorrentCounts` instead of dicts
+        :type records: bool
         :return: List of dictionaries with torrent stats
         :rtype: []dict
         """
-        return self._request("/counts").json()
+        counts = self._cached("get_torrent_counts", "get_torrent_counts",
+                              lambda: self._get_json("/counts"))
+        if records:
+            return [TorrentCounts.from_json(c) for c in counts]
+        return counts
+
+    def iter_torrent_counts(self, records=False, chunk_size=65536):
+        """ Stream the torrent counts, yielding each row as it is parsed from the response
+        instead of decoding the entire /counts document at once. Rows are the same as those
+        returned by :meth:`get_torrent_counts`.
+
+        :param records: Yield :class:`totv.records.TorrentCounts` instead of dicts
+        :type records: bool
+        :param chunk_size: Size of the chunks read from the response
+        :type chunk_size: int
+        :return: Generator of torrent counts
+        :rtype: generator
+        """
+        resp = self._request("/counts", stream=True)
+        try:
+            for row in jsonutil.iter_array(resp.iter_content(chunk_size)):
+                yield TorrentCounts.from_json(row) if records else row
+        finally:
+            resp.close()
+
+    def get_torrent_counts_snapshot(self):
+        """ Fetch the current torrent counts as a columnar, numpy backed snapshot. The
+        response is streamed into the snapshot without building the list of count dicts.
+
+        :return: Snapshot of the counts for all torrents
+        :rtype: totv.counts.CountsSnapshot
+        """
+        # numpy is only required when snapshots are used
+        from totv.counts import CountsSnapshot
+        return CountsSnapshot.from_iter(self.iter_torrent_counts())
 
     def user_get_active(self, user_id):
         pass
@@ -233,42 +1016,90 @@ class Client(object):
         pass
 
     def user_update(self, user_id, uploaded=None, downloaded=None, passkey=None, can_leech=None,
-                    enabled=None):
-        user = self.user_get(user_id)
-        updated_data = {
-            "name": user["username"],
-            'uploaded': uploaded if uploaded is not None else user['uploaded'],
-            'downloaded': downloaded if downloaded is not None else user['downloaded'],
-            'can_leech': can_leech if can_leech is not None else user['can_leech'],
-            'passkey': passkey if passkey is not None else user['passkey'],
-            "enabled": enabled if enabled is not None else user["enabled"]
-        }
+                    enabled=None, partial=False):
+        """ Update a users tracker attributes, unspecified attributes are left unchanged
+
+        By default the current user is fetched first to fill in the unspecified fields. The
+        user cache is only used when both uploaded and downloaded are given, since the
+        tracker updates them on every announce. With partial set only the specified fields
+        are sent, which never needs the extra request.
+
+        :param partial: Only send the fields that are being changed
+        :type partial: bool
+        :return: Update success
+        :rtype: bool
+        """
+        changes = {k: v for k, v in (('uploaded', uploaded), ('downloaded', downloaded),
+                                     ('passkey', passkey), ('can_leech', can_leech),
+                                     ('enabled', enabled)) if v is not None}
+        if partial:
+            updated_data = changes
+        else:
+            # Transfer stats change as the user announces, never fill them from the cache
+            fresh = uploaded is None or downloaded is None
+            user = self.user_get(user_id, use_cache=not fresh)
+            updated_data = {
+                "name": user["username"],
+                'uploaded': uploaded if uploaded is not None else user['uploaded'],
+                'downloaded': downloaded if downloaded is not None else user['downloaded'],
+                'can_leech': can_leech if can_leech is not None else user['can_leech'],
+                'passkey': passkey if passkey is not None else user['passkey'],
+                "enabled": enabled if enabled is not None else user["enabled"]
+            }
 
         resp = self._request("/user/{}".format(user_id), 'post', payload=updated_data)
         if resp.status_code == httplib.ACCEPTED:
+            self._user_cache_update(user_id, changes)
             return True
         else:
             raise exc.BadResponse("Received bad response from server: {}".format(resp.status_code))
 
-    def user_get(self, user_id):
-        resp = self._request("/user/{}".format(user_id))
-        if resp.ok:
-            return resp.json()
-        elif resp.status_code == httplib.NOT_FOUND:
+    def _user_cache_update(self, user_id, changes):
+        if self._user_cache is None:
+            return
+        user = self._user_cache.get(user_id)
+        if user is not MISSING:
+            user = dict(user)
+            user.update(changes)
+            # Keep the original expiry, frequent updates must not keep a stale copy alive
+            self._user_cache.replace(user_id, user)
+
+    def user_get(self, user_id, use_cache=True):
+        """ Fetch a user from the tracker, or from the user cache when enabled
+
+        :param user_id: User to fetch
+        :type user_id: int
+        :param use_cache: Allow the user to be served from the user cache
+        :type use_cache: bool
+        :rtype: dict
+        """
+        if self._user_cache is not None and use_cache:
+            user = self._user_cache.get(user_id)
+            if user is not MISSING:
+                return dict(user)
+        try:
+            user = self._get_json("/user/{}".format(user_id))
+        except exc.NotFoundError:
             raise exc.NotFoundError("Unknown user id: {}".format(user_id))
-        else:
-            raise exc.BadResponse("Error fetching user api")
+        if self._user_cache is not None:
+            self._user_cache.set(user_id, dict(user))
+        return user
 
-    def user_add(self, name, user_id, passkey, can_leech=True):
-        self._request("/user", method='post', payload={
+    def _user_add(self, name, user_id, passkey, can_leech=True):
+        return self._request("/user", method='post', payload={
             'user_id': user_id,
             'passkey': passkey,
             'can_leech': can_leech,
             'name': name
         })
+
+    def user_add(self, name, user_id, passkey, can_leech=True):
+        self._user_add(name, user_id, passkey, can_leech=can_leech)
         return self.user_get(user_id)
 
     def user_del(self, user_id):
+        if self._user_cache is not None:
+            self._user_cache.delete(user_id)
         resp = self._request("/user/{}".format(user_id), method="delete")
         return resp.ok
 
@@ -294,111 +1125,365 @@ class Client(object):
         else:
             raise exc.BadResponse("Bad response from server: {}".format(resp.status_code))
 
-    def torrent_get_all_redis(self):
-        torrents = []
-        keys = self._redis.keys("t:t:*")
-        for key in keys:
+    def _bulk(self, func, items, chunk_size=100, concurrency=4):
+        """ Run func over items in chunks, with each chunk spread over a bounded thread pool.
+        Failures are collected instead of aborting the remaining items.
+
+        :rtype: BulkResult
+        """
+        result = BulkResult()
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            for chunk in chunks(items, chunk_size):
+                futures = [executor.submit(call_item, func, item) for item in chunk]
+                for item, future in zip(chunk, futures):
+                    try:
+                        future.result()
+                    except (exc.TOTVException, requests.RequestException) as err:
+                        result.add(item, err)
+                    else:
+                        result.add(item)
+        return result
+
+    def torrent_add_many(self, torrents, chunk_size=100, concurrency=4):
+        """ Add many torrents to the tracker, see :meth:`torrent_add`
+
+        :param torrents: (info_hash, torrent_id, name) tuples or dicts with the same keys
+        :type torrents: iterable
+        :param chunk_size: Number of torrents submitted to the worker pool at a time
+        :type chunk_size: int
+        :param concurrency: Maximum number of concurrent requests
+        :type concurrency: int
+        :return: Outcome of each torrent
+        :rtype: BulkResult
+        """
+        return self._bulk(self.torrent_add, torrents, chunk_size, concurrency)
+
+    def user_add_many(self, users, chunk_size=100, concurrency=4):
+        """ Add many users to the tracker. Unlike :meth:`user_add` the new users are not
+        fetched back from the tracker.
+
+        :param users: (name, user_id, passkey[, can_leech]) tuples or dicts with the same keys
+        :type users: iterable
+        :param chunk_size: Number of users submitted to the worker pool at a time
+        :type chunk_size: int
+        :param concurrency: Maximum number of concurrent requests
+        :type concurrency: int
+        :return: Outcome of each user
+        :rtype: BulkResult
+        """
+        return self._bulk(self._user_add, users, chunk_size, concurrency)
+
+    def whitelist_add_many(self, clients, chunk_size=100, concurrency=4):
+        """ Add many client prefixes to the whitelist, see :meth:`whitelist_add`
+
+        :param clients: (prefix, client_name) tuples or dicts with the same keys
+        :type clients: iterable
+        :param chunk_size: Number of entries submitted to the worker pool at a time
+        :type chunk_size: int
+        :param concurrency: Maximum number of concurrent requests
+        :type concurrency: int
+        :return: Outcome of each entry
+        :rtype: BulkResult
+        """
+        return self._bulk(self.whitelist_add, clients, chunk_size, concurrency)
+
+    def _scan_keys(self, pattern, scan_count=None):
+        """ Incrementally iterate over the keys matching pattern using SCAN so the
+        server is never blocked and the full key list is never held in memory.
+
+        SCAN may return a key more than once if the keyspace is rehashed during iteration.
+        """
+        return self._redis.scan_iter(match=pattern, count=scan_count or self._scan_count)
+
+    def _hgetall_batched(self, keys, batch_size=None):
+        """ Fetch the hashes stored at keys using pipelined batches of HGETALL calls,
+        one round trip per batch.
+
+        Errors are returned in place of the hash for the key that caused them instead of
+        being raised so the caller can decide how to handle each key.
+
+        :return: Generator of (key, hash or redis.ResponseError) tuples
+        :rtype: generator
+        """
+        for batch in chunks(keys, batch_size or self._batch_size):
+            pipe = self._redis.pipeline(transaction=False)
+            for key in batch:
+                pipe.hgetall(key)
+            for key, data in zip(batch, pipe.execute(raise_on_error=False)):
+                yield key, data
+
+    def _torrent_keys(self, scan_count=None):
+        for key in self._scan_keys("t:t:*", scan_count):
             try:
                 key = key.decode()
             except UnicodeDecodeError:
                 pass
-            try:
-                if len(key) != 44:
-                    continue
-                tor = self._redis.hgetall(key)
-            except redis.ResponseError as err:
-                print(err)
+            if len(key) == 44:
+                yield key
+
+    def iter_torrents_redis(self, scan_count=None, batch_size=None, sort=None,
+                            sort_chunk_size=100000, records=False):
+        """ Lazily iterate over all torrent hashes stored in redis as the SCAN cursor advances.
+        Hashes are read in pipelined batches.
+
+        When sort is set the torrents are ordered using an external merge sort, holding at
+        most sort_chunk_size torrents in memory at once.
+
+        :param scan_count: COUNT hint for each SCAN call, defaults to the clients scan_count
+        :type scan_count: int
+        :param batch_size: Number of HGETALL calls per pipeline, defaults to the clients batch_size
+        :type batch_size: int
+        :param sort: Integer hash field to sort by (eg: "seeders") or a key function
+        :type sort: str, callable
+        :param sort_chunk_size: Maximum number of torrents held in memory while sorting
+        :type sort_chunk_size: int
+        :param records: Yield :class:`totv.records.Torrent` instead of raw hashes
+        :type records: bool
+        :return: Generator of raw torrent hashes
+        :rtype: generator
+        """
+        torrents = self._iter_torrents_redis(scan_count, batch_size, records)
+        if sort is None:
+            return torrents
+        if callable(sort):
+            pass
+        elif records:
+            sort = attrgetter(sort)
+        else:
+            field = sort.encode()
+            sort = lambda t: int(t.get(field, b"-1"))
+        return external_sort(torrents, key=sort, chunk_size=sort_chunk_size)
+
+    def _iter_torrents_redis(self, scan_count=None, batch_size=None, records=False):
+        for key, tor in self._hgetall_batched(self._torrent_keys(scan_count), batch_size):
+            if isinstance(tor, redis.ResponseError):
+                print(tor)
                 print(key)
                 break
-            else:
-                torrents.append(tor)
-        return torrents
+            yield Torrent.from_redis(tor, info_hash=key[4:]) if records else tor
 
-    def users_get_all_redis(self, sort="user_id"):
-        users = []
-        keys = [k for k in self._redis.keys("t:u:*")]
-        for k in keys:
-            try:
-                k = k.decode()
-                data = self._redis.hgetall(k)
-                user = {
-                    'passkey': data.get(b'passkey', "ERROR: PASSKEY NOT SET"),
-                    'user_id': int(data.get(b'user_id', b"-1")),
-                    'downloaded': int(data.get(b'downloaded', b"-1")),
-                    'uploaded': int(data.get(b'uploaded', b"-1")),
-                    'username': data.get(b'username', b"ERROR: NO USER!").decode(),
-                    'enabled': data.get(b'enabled', b"0").decode()
-                }
-                users.append(user)
-            except redis.ResponseError:
+    def torrent_get_all_redis(self, scan_count=None, batch_size=None, records=False):
+        return list(self.iter_torrents_redis(scan_count=scan_count, batch_size=batch_size,
+                                             records=records))
+
+    def iter_users_redis(self, scan_count=None, batch_size=None, sort=None,
+                         sort_chunk_size=100000, records=False):
+        """ Lazily iterate over all users stored in redis as the SCAN cursor advances. Users
+        are read in pipelined batches and yielded in keyspace order.
+
+        When sort is set the users are ordered using an external merge sort, holding at
+        most sort_chunk_size users in memory at once.
+
+        :param scan_count: COUNT hint for each SCAN call, defaults to the clients scan_count
+        :type scan_count: int
+        :param batch_size: Number of HGETALL calls per pipeline, defaults to the clients batch_size
+        :type batch_size: int
+        :param sort: User field to sort by (eg: "user_id") or a key function
+        :type sort: str, callable
+        :param sort_chunk_size: Maximum number of users held in memory while sorting
+        :type sort_chunk_size: int
+        :param records: Yield :class:`totv.records.User` instead of dicts
+        :type records: bool
+        :return: Generator of user dicts
+        :rtype: generator
+        """
+        users = self._iter_users_redis(scan_count, batch_size, records)
+        if sort is None:
+            return users
+        if not callable(sort):
+            sort = attrgetter(sort) if records else itemgetter(sort)
+        return external_sort(users, key=sort, chunk_size=sort_chunk_size)
+
+    def _iter_users_redis(self, scan_count=None, batch_size=None, records=False):
+        decode = User.from_redis if records else user_from_redis
+        for k, data in self._hgetall_batched(self._scan_keys("t:u:*", scan_count), batch_size):
+            if isinstance(data, redis.ResponseError):
                 # print("Dropping erroneous key: {}".format(k))
                 # self._redis.delete(k)
-                pass
+                continue
+            try:
+                user = decode(data)
             except Exception as err:
                 print(err)
                 print(data)
                 print(k)
                 break
+            else:
+                yield user
 
-        users.sort(key=lambda u: u[sort])
+    def users_get_all_redis(self, sort="user_id", scan_count=None, batch_size=None,
+                            records=False):
+        users = list(self.iter_users_redis(scan_count=scan_count, batch_size=batch_size,
+                                           records=records))
+        users.sort(key=attrgetter(sort) if records else itemgetter(sort))
         return users
 
-    def cleanup(self, delete=False):
-        # Look for active/inactive user suffix keys etc. t:u:$id:*
-        keys = [k for k in self._redis.keys("t:u:*")]
-        old_keys = []
-        for key in keys:
-            if len(key.split(b":")) != 3:
-                old_keys.append(key)
-            else:
-                user = self._redis.hgetall(key)
-                self._validate_int_fields(key, user,
-                                          [b'downloaded', b'uploaded', b'snatches', b'announces',
-                                           b'corrupt'])
-        for key in old_keys:
-            print(key)
-            if delete:
-                self._redis.delete(key)
-        # Look for peer suffix keys t:t:$ih:*
-        keys = [k for k in self._redis.keys("t:t:*")]
-        old_keys_2 = []
+    def cleanup(self, delete=False, scan_count=None, batch_size=None, workers=4,
+                state_path=None, sample_size=10, server_side=False):
+        """ Look for stale keys and out of range integer fields in the user (t:u:*) and
+        torrent (t:t:*) hashes.
+
+        Each key pattern is a shard with its own SCAN cursor and connection, shards are
+        scanned concurrently while every page of keys is checked by a pool of workers. Hashes
+        are read with pipelined HGETALL calls and the fixes for a page are written in a
+        single MULTI/EXEC transaction.
+
+        Without delete nothing is written, the returned report describes what would change.
+        With a state_path the last completed cursor of every shard is saved after each page
+        so an interrupted run picks up where it stopped, the file is removed once every
+        shard is finished.
+
+        With server_side the integer fields are checked and reset by a Lua script run
+        against each batch of keys, only the keys with problems are sent back.
+
+        >>> report = client.cleanup()
+        >>> report.problems
+        {'stale_key': 12, 'negative_int': 1}
+        >>> client.cleanup(delete=True, state_path="cleanup.json")
+
+        :param delete: Delete stale keys and reset invalid integer fields to 0
+        :type delete: bool
+        :param scan_count: COUNT hint passed to SCAN, defaults to the clients scan_count
+        :type scan_count: int
+        :param batch_size: Number of HGETALL calls per pipeline, defaults to the clients
+            batch_size
+        :type batch_size: int
+        :param workers: Number of threads checking pages of keys
+        :type workers: int
+        :param state_path: Optional JSON file used to persist the SCAN cursors between runs
+        :type state_path: str
+        :param sample_size: Number of example keys kept for each problem class
+        :type sample_size: int
+        :param server_side: Validate the integer fields inside redis using a Lua script
+        :type server_side: bool
+        :rtype: CleanupReport
+        """
+        cursors = {pattern: 0 for pattern, _, _ in CLEANUP_SHARDS}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as fp:
+                cursors.update(json.load(fp))
+        report = CleanupReport(sample_size, cursors)
+        shards = [shard for shard in CLEANUP_SHARDS if cursors[shard[0]] is not None]
+        if not shards:
+            return report
+        with ThreadPoolExecutor(max_workers=len(shards)) as scanners, \
+                ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [scanners.submit(self._cleanup_shard, shard, executor, report, delete,
+                                       scan_count or self._scan_count, batch_size, state_path,
+                                       workers, server_side)
+                       for shard in shards]
+            for future in futures:
+                future.result()
+        if state_path and report.complete and os.path.exists(state_path):
+            os.remove(state_path)
+        return report
+
+    def _cleanup_shard(self, shard, executor, report, delete, scan_count, batch_size,
+                       state_path, window, server_side=False):
+        pattern = shard[0]
+        cursor = report.cursors[pattern]
+        pending = deque()
+
+        def checkpoint():
+            next_cursor, future = pending.popleft()
+            future.result()
+            with report._lock:
+                report.cursors[pattern] = next_cursor or None
+                if state_path:
+                    with open(state_path, "w") as fp:
+                        json.dump(report.cursors, fp)
+
+        while True:
+            cursor, keys = self._redis.scan(cursor, match=pattern, count=scan_count)
+            pending.append((cursor, executor.submit(self._cleanup_keys, shard, keys, report,
+                                                    delete, batch_size, server_side)))
+            # Cursors are only saved once every page before them is done
+            while pending and (len(pending) > window or pending[0][1].done()):
+                checkpoint()
+            if cursor == 0:
+                break
+        while pending:
+            checkpoint()
+
+    def _cleanup_keys(self, shard, keys, report, delete, batch_size=None, server_side=False):
+        _, is_stale, int_fields = shard
+        stale = []
+        check = []
         for key in keys:
-            k = key.split(b":")
-            if len(k) != 3 or k[2].startswith(b"b'"):
-                old_keys_2.append(key)
-            else:
-                # Look for old int based keys
-                try:
-                    int(k[2])
-                except Exception:
-                    torrent = self._redis.hgetall(key.decode())
-                    self._validate_int_fields(key.decode(), torrent,
-                                              [b'downloaded', b'uploaded', b'snatches',
-                                               b'announces', b'seeders',
-                                               b'leechers'], update=delete)
+            (stale if is_stale(key) else check).append(key)
+        for key in stale:
+            report.add(STALE_KEY, key)
+        if server_side:
+            fixed = 0
+            for key, invalid in self._repair_int_fields(check, int_fields, delete, batch_size):
+                if invalid is None:
+                    report.add(WRONG_TYPE, key)
+                    continue
+                for problem in invalid.values():
+                    report.add(problem, key)
+                fixed += 1
+            if delete and stale:
+                self._redis.delete(*stale)
+            report.count(len(keys), len(stale) if delete else 0, fixed if delete else 0)
+            return
+        fixes = []
+        for key, data in self._hgetall_batched(check, batch_size):
+            if isinstance(data, Exception):
+                report.add(WRONG_TYPE, key)
+                continue
+            invalid = self._validate_int_fields(key, data, int_fields)
+            for problem in invalid.values():
+                report.add(problem, key)
+            if invalid:
+                fixes.append((key, invalid))
+        if delete and (stale or fixes):
+            pipe = self._redis.pipeline(transaction=True)
+            if stale:
+                pipe.delete(*stale)
+            for key, invalid in fixes:
+                pipe.hset(key, mapping={hash_key: 0 for hash_key in invalid})
+            pipe.execute()
+            report.count(len(keys), len(stale), len(fixes))
+        else:
+            report.count(len(keys))
+
+    def _repair_int_fields(self, keys, hash_keys, update=False, batch_size=None):
+        """ Validate, and optionally reset, the integer fields of hashes inside redis using
+        :data:`REPAIR_INT_FIELDS_LUA`. The script is loaded once and then called by its
+        SHA1 digest, one call per batch of keys.
+
+        :return: Generator of (key, {field: problem}) tuples for the hashes with problems,
+            the dict is None for keys that are not hashes
+        :rtype: generator
+        """
+        if self._repair_script is None:
+            self._repair_script = self._redis.register_script(REPAIR_INT_FIELDS_LUA)
+        args = [b"1" if update else b"0", str(MAX_INT).encode()] + list(hash_keys)
+        for batch in chunks(keys, batch_size or self._batch_size):
+            for entry in self._repair_script(keys=batch, args=args):
+                key = entry[0]
+                if not entry[1]:
+                    yield key, None
                 else:
-                    old_keys_2.append(key)
-        for key in old_keys_2:
-            print(key)
-            if delete:
-                self._redis.delete(key)
-
-    def _validate_int_fields(self, key, data, hash_keys, update=False):
-        # Nothing should be this large yet, even if not max int size
-        max_int = 2 ** 62
+                    yield key, dict(zip(entry[1::2], [p.decode() for p in entry[2::2]]))
+
+    def _validate_int_fields(self, key, data, hash_keys):
+        """ Check the integer fields of a hash
+
+        :return: Problem class of every field that needs to be reset to 0
+        :rtype: dict
+        """
+        invalid = {}
         for hash_key in hash_keys:
-            reset = False
             try:
                 v = int(data[hash_key])
             except KeyError:
-                print("[{}] No hash key: {}".format(key, hash_key))
-                reset = True
+                invalid[hash_key] = MISSING_FIELD
+            except ValueError:
+                invalid[hash_key] = INVALID_INT
             else:
                 if v < 0:
-                    print("[{}] Negative int: {}".format(hash_key))
-                    reset = True
-                elif v > max_int:
-                    print("[{}] Max int: {}".format(hash_key, v))
-                    reset = True
-            if reset:
-                self._redis.hset(key, hash_key, 0)
+                    invalid[hash_key] = NEGATIVE_INT
+                elif v > MAX_INT:
+                    invalid[hash_key] = INT_OVERFLOW
+        return invalid